@@ -11,9 +11,18 @@ setup(
     packages=find_packages('src'),
     package_dir={'': 'src'},
     install_requires=[
-        'asynqp >= 0.5.1',
+        'asynqp >= 0.5.1, < 0.7',
     ],
     extras_require={
+        'uvloop': [
+            'uvloop',
+        ],
+        'zstd': [
+            'zstandard',
+        ],
+        'lz4': [
+            'lz4',
+        ],
         'test': [
             'pycodestyle',
             'pylint',
@@ -1,6 +1,11 @@
 # pylint: disable=unused-import
+from .columnar import ColumnarBatch
 from .connect import connect_and_open_channel
 from .consumer import Consumer
+from .manager import ConnectionManager
 from .message import Message
 from .queue import declare_queue
-from .records import ConnectionParams, Exchange, Queue, QueueBinding
+from .ratelimit import TokenBucket
+from .records import ConnectionParams, Exchange, Queue, QueueBinding, QueueStats
+from .runner import run
+from .spool import Spool
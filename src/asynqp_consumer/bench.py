@@ -0,0 +1,434 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple  # pylint: disable=unused-import
+
+import asynqp
+
+from asynqp_consumer.consumer import Consumer
+from asynqp_consumer.message import Message
+from asynqp_consumer.records import Queue
+from asynqp_consumer.runner import install_uvloop
+
+
+class BenchCallbackError(Exception):
+    pass
+
+
+class Broker:
+    # Stands in for a ConnectionManager, Consumer only calls open_channel() on it.
+
+    def __init__(self, make_body: Callable[[int, float], bytes]) -> None:
+        self.make_body = make_body
+        self.published = 0
+        self.acked = 0
+        self.rejected = 0
+        self.redelivered = 0
+        self.processed = 0
+        self.latencies = []  # type: List[float]
+        self.delivery_latencies = []  # type: List[float]
+
+        self._pending = deque()  # type: Deque[Tuple[int, float]]
+        self._unacked = {}  # type: Dict[int, Tuple[BrokerChannel, Tuple[int, float]]]
+        self._consumers = []  # type: List[Tuple[BrokerChannel, Callable[[asynqp.IncomingMessage], None]]]
+        self._next_consumer = 0
+        self._next_delivery_tag = 0
+        self._connection = None  # type: Optional[BrokerConnection]
+
+    async def open_channel(self) -> Tuple[asynqp.Connection, asynqp.Channel]:
+        if self._connection is None or self._connection.closed.done():
+            self._connection = BrokerConnection(self)
+        return self._connection, await self._connection.open_channel()
+
+    async def close(self) -> None:
+        if self._connection is not None and not self._connection.closed.done():
+            await self._connection.close()
+
+    @property
+    def backlog(self) -> int:
+        return len(self._pending)
+
+    def publish(self, count: int = 1) -> None:
+        now = time.monotonic()
+        for _ in range(count):
+            self._pending.append((self.published, now))
+            self.published += 1
+        self._deliver()
+
+    def add_consumer(self, channel: 'BrokerChannel', callback: Callable[[asynqp.IncomingMessage], None]) -> None:
+        self._consumers.append((channel, callback))
+        self._deliver()
+
+    def remove_consumer(self, channel: 'BrokerChannel') -> None:
+        self._consumers = [(c, callback) for c, callback in self._consumers if c is not channel]
+
+    def remove_channel(self, channel: 'BrokerChannel') -> None:
+        self._consumers = [(c, callback) for c, callback in self._consumers if c is not channel]
+        for delivery_tag, (c, message) in list(self._unacked.items()):
+            if c is channel:
+                del self._unacked[delivery_tag]
+                channel.unacked_count -= 1
+                self._requeue(message)
+        self._deliver()
+
+    def ack(self, delivery_tag: int) -> None:
+        channel, _ = self._unacked.pop(delivery_tag)
+        channel.unacked_count -= 1
+        self.acked += 1
+        self._deliver()
+
+    def processed_messages(self, messages: List[Message]) -> None:
+        now = time.monotonic()
+        self.processed += len(messages)
+        self.latencies.extend(now - message.body['published_at'] for message in messages)
+        self.delivery_latencies.extend(now - message.delivered_at for message in messages)
+
+    def reject(self, delivery_tag: int, requeue: bool) -> None:
+        channel, message = self._unacked.pop(delivery_tag)
+        channel.unacked_count -= 1
+        self.rejected += 1
+        if requeue:
+            self._requeue(message)
+        self._deliver()
+
+    def _requeue(self, message: Tuple[int, float]) -> None:
+        self.redelivered += 1
+        self._pending.appendleft(message)
+
+    def _deliver(self) -> None:
+        while self._pending and self._consumers:
+            for _ in range(len(self._consumers)):
+                channel, callback = self._consumers[self._next_consumer % len(self._consumers)]
+                self._next_consumer += 1
+                if channel.no_ack or not channel.prefetch_count or channel.unacked_count < channel.prefetch_count:
+                    break
+            else:
+                return
+
+            message = self._pending.popleft()
+            self._next_delivery_tag += 1
+            if not channel.no_ack:
+                self._unacked[self._next_delivery_tag] = (channel, message)
+                channel.unacked_count += 1
+            callback(BrokerMessage(
+                body=self.make_body(*message),
+                sender=channel,
+                delivery_tag=self._next_delivery_tag,
+                exchange_name='',
+                routing_key='bench',
+            ))
+
+
+class BrokerMessage(asynqp.IncomingMessage):
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.delivered_at = time.monotonic()
+
+
+class BrokerConnection:
+
+    def __init__(self, broker: Broker) -> None:
+        self.broker = broker
+        self.closed = asyncio.Future()  # type: asyncio.Future
+
+    async def open_channel(self) -> 'BrokerChannel':
+        return BrokerChannel(self.broker)
+
+    async def close(self) -> None:
+        self.closed.set_result(None)
+
+
+class BrokerChannel:
+
+    def __init__(self, broker: Broker) -> None:
+        self.broker = broker
+        self.prefetch_count = 0
+        self.unacked_count = 0
+        self.no_ack = False
+
+    async def set_qos(self, prefetch_count: int = 0) -> None:
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: str, **kwargs: Any) -> 'BrokerQueue':  # pylint: disable=unused-argument
+        return BrokerQueue(self, name)
+
+    async def close(self) -> None:
+        self.broker.remove_channel(self)
+
+    def send_BasicAck(self, delivery_tag: int) -> None:
+        self.broker.ack(delivery_tag)
+
+    def send_BasicReject(self, delivery_tag: int, requeue: bool) -> None:
+        self.broker.reject(delivery_tag, requeue)
+
+
+class BrokerQueue:
+
+    def __init__(self, channel: BrokerChannel, name: str) -> None:
+        self.channel = channel
+        self.name = name
+
+    async def consume(
+            self,
+            callback: Callable[[asynqp.IncomingMessage], None],
+            no_ack: bool = False,
+            arguments: Any = None,  # pylint: disable=unused-argument
+    ) -> 'BrokerConsumer':
+        self.channel.no_ack = no_ack
+        self.channel.broker.add_consumer(self.channel, callback)
+        return BrokerConsumer(self.channel)
+
+
+class BrokerConsumer:
+
+    def __init__(self, channel: BrokerChannel) -> None:
+        self.channel = channel
+
+    async def cancel(self) -> None:
+        self.channel.broker.remove_consumer(self.channel)
+
+
+def make_body_factory(payload_size: int, shape: str) -> Callable[[int, float], bytes]:
+    payload = 'x' * payload_size
+
+    if shape == 'flat':
+        return lambda message_id, published_at: json.dumps({
+            'id': message_id,
+            'published_at': published_at,
+            'payload': payload,
+        }).encode()
+
+    if shape == 'nested':
+        return lambda message_id, published_at: json.dumps({
+            'id': message_id,
+            'published_at': published_at,
+            'meta': {'source': 'bench', 'tags': ['a', 'b', 'c']},
+            'data': {'payload': payload, 'values': list(range(10))},
+        }).encode()
+
+    raise ValueError('Unknown JSON shape: {}'.format(shape))
+
+
+def make_callback(
+        broker: Broker,
+        latency: float,
+        latency_distribution: str,
+        failure_rate: float,
+        rng: random.Random,
+) -> Callable[[List[Message]], Any]:
+    async def callback(messages: List[Message]) -> None:
+        if latency:
+            delay = rng.expovariate(1 / latency) if latency_distribution == 'exponential' else latency
+            await asyncio.sleep(delay)
+        if failure_rate and rng.random() < failure_rate:
+            raise BenchCallbackError('Simulated callback failure for {} messages.'.format(len(messages)))
+        broker.processed_messages(messages)
+
+    return callback
+
+
+def get_rss() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource  # not available on Windows
+
+        # ru_maxrss is the peak in kilobytes on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def latency_report(latencies: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        name: None if value is None else value * 1000
+        for name, value in [
+            ('p50', percentile(latencies, 50)),
+            ('p90', percentile(latencies, 90)),
+            ('p99', percentile(latencies, 99)),
+            ('max', latencies[-1] if latencies else None),
+        ]
+    }
+
+
+async def publish(broker: Broker, rate: float, backlog: int) -> None:
+    started_at = time.monotonic()
+    while True:
+        if rate:
+            due = int((time.monotonic() - started_at) * rate) - broker.published
+            if due > 0:
+                broker.publish(due)
+        elif broker.backlog < backlog:
+            broker.publish(backlog - broker.backlog)
+        await asyncio.sleep(0.01)
+
+
+async def sample_rss(samples: List[Tuple[float, int]], started_at: float, interval: float) -> None:
+    while True:
+        samples.append((round(time.monotonic() - started_at, 3), get_rss()))
+        await asyncio.sleep(interval)
+
+
+async def run_bench(options: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(options.seed)
+    broker = Broker(make_body_factory(options.payload_size, options.shape))
+    consumer = Consumer(
+        queue=Queue('bench', bindings=[]),
+        callback=make_callback(
+            broker, options.callback_latency, options.latency_distribution, options.failure_rate, rng,
+        ),
+        prefetch_count=options.prefetch_count,
+        check_bulk_interval=options.check_bulk_interval,
+        channels=options.channels,
+        connection_manager=broker,
+        ack_mode=options.ack_mode,
+        no_ack_buffer_size=options.no_ack_buffer_size,
+        drop_overflow=options.drop_overflow,
+    )
+
+    rss_samples = []  # type: List[Tuple[float, int]]
+    started_at = time.monotonic()
+    tasks = [
+        asyncio.ensure_future(consumer.start()),
+        asyncio.ensure_future(publish(broker, options.rate, max(options.prefetch_count * options.channels * 4, 1000))),
+        asyncio.ensure_future(sample_rss(rss_samples, started_at, options.sample_interval)),
+    ]
+
+    await asyncio.sleep(options.duration)
+    elapsed = time.monotonic() - started_at
+    # Closing the consumer requeues its unacked messages, so take the counters first.
+    counters = {
+        'published': broker.published,
+        'processed': broker.processed,
+        'acked': broker.acked,
+        'rejected': broker.rejected,
+        'redelivered': broker.redelivered,
+        'backlog': broker.backlog,
+        'dropped': consumer.dropped,
+    }
+    latencies = sorted(broker.latencies)
+    delivery_latencies = sorted(broker.delivery_latencies)
+
+    for task in tasks[1:]:
+        task.cancel()
+    consumer.close()
+    await tasks[0]
+    await broker.close()
+
+    return {
+        'config': {
+            'rate': options.rate,
+            'duration': options.duration,
+            'payload_size': options.payload_size,
+            'shape': options.shape,
+            'prefetch_count': options.prefetch_count,
+            'check_bulk_interval': options.check_bulk_interval,
+            'channels': options.channels,
+            'callback_latency': options.callback_latency,
+            'latency_distribution': options.latency_distribution,
+            'failure_rate': options.failure_rate,
+            'seed': options.seed,
+            'uvloop': options.uvloop,
+            'ack_mode': options.ack_mode,
+            'no_ack_buffer_size': options.no_ack_buffer_size,
+            'drop_overflow': options.drop_overflow,
+        },
+        'published': counters['published'],
+        'processed': counters['processed'],
+        'acked': counters['acked'],
+        'rejected': counters['rejected'],
+        'redelivered': counters['redelivered'],
+        'backlog': counters['backlog'],
+        'dropped': counters['dropped'],
+        'throughput': counters['processed'] / elapsed,
+        # From publish, so it includes time spent in the broker's backlog. With --rate 0 the backlog is kept
+        # full and dominates it, delivery_latency_ms then shows the consumer's own latency.
+        'latency_ms': latency_report(latencies),
+        # From delivery to the consumer until the callback succeeded.
+        'delivery_latency_ms': latency_report(delivery_latencies),
+        'rss': rss_samples,
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m asynqp_consumer.bench',
+        description='Run a Consumer against an in-process broker stand-in under synthetic load.',
+    )
+    parser.add_argument('--rate', type=float, default=0, help='messages per second, 0 keeps the queue saturated')
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--payload-size', type=int, default=256, help='bytes of padding in each JSON body')
+    parser.add_argument('--shape', choices=['flat', 'nested'], default='flat', help='JSON body shape')
+    parser.add_argument('--prefetch-count', type=int, default=100)
+    parser.add_argument('--check-bulk-interval', type=float, default=0.3)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--ack-mode', choices=Consumer.ACK_MODES, default='ack')
+    parser.add_argument('--no-ack-buffer-size', type=int, default=10000)
+    parser.add_argument('--drop-overflow', action='store_true', help='drop deliveries when the no-ack buffer is full')
+    parser.add_argument('--callback-latency', type=float, default=0, help='mean seconds per batch')
+    parser.add_argument('--latency-distribution', choices=['fixed', 'exponential'], default='fixed')
+    parser.add_argument('--failure-rate', type=float, default=0, help='probability of a batch failing')
+    parser.add_argument('--sample-interval', type=float, default=1, help='seconds between RSS samples')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--uvloop', action='store_true', help='use uvloop when installed')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help='show consumer logs')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    options = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if options.verbose else logging.CRITICAL)
+    if options.uvloop:
+        options.uvloop = install_uvloop()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        report = loop.run_until_complete(run_bench(options))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    latency = report['latency_ms']
+    delivery_latency = report['delivery_latency_ms']
+    print(
+        'throughput: {:.0f} msg/s, latency p50/p90/p99: {}/{}/{} ms (from delivery: {}/{}/{} ms), '
+        'redelivered: {}, dropped: {}, peak RSS: {:.1f} MiB'.format(
+            report['throughput'],
+            *('{:.1f}'.format(latency[name]) if latency[name] is not None else '-' for name in ('p50', 'p90', 'p99')),
+            *(
+                '{:.1f}'.format(delivery_latency[name]) if delivery_latency[name] is not None else '-'
+                for name in ('p50', 'p90', 'p99')
+            ),
+            report['redelivered'],
+            report['dropped'],
+            max(rss for _, rss in report['rss']) / 2 ** 20,
+        ),
+        file=sys.stderr,
+    )
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
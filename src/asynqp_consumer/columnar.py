@@ -0,0 +1,63 @@
+import json
+from array import array
+from typing import Any, Dict, List, MutableSequence, Tuple
+
+from asynqp_consumer.compression import DecompressionError
+from asynqp_consumer.message import Message
+
+
+# Field name -> array typecode ('q', 'd', ...), 'O' keeps values in a plain list.
+Schema = Dict[str, str]
+
+OBJECT_TYPECODE = 'O'
+
+
+class ColumnarBatch:
+
+    def __init__(self, columns: Dict[str, MutableSequence[Any]], messages: List[Message]) -> None:
+        self.columns = columns
+        self.messages = messages  # row index -> message
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __getitem__(self, name: str) -> MutableSequence[Any]:
+        return self.columns[name]
+
+    def __repr__(self):
+        return '<{} rows={} columns={}>'.format(type(self).__name__, len(self), list(self.columns))
+
+
+def _make_column(typecode: str) -> MutableSequence[Any]:
+    return [] if typecode == OBJECT_TYPECODE else array(typecode)
+
+
+def validate_schema(schema: Schema) -> None:
+    for name, typecode in schema.items():
+        try:
+            _make_column(typecode)
+        except (ValueError, TypeError) as e:
+            raise ValueError('Invalid typecode {!r} for column {!r}.'.format(typecode, name)) from e
+
+
+def decode_columns(messages: List[Message], schema: Schema) -> Tuple[ColumnarBatch, List[Message]]:
+    columns = {name: _make_column(typecode) for name, typecode in schema.items()}
+    rows = []  # type: List[Message]
+    invalid = []  # type: List[Message]
+
+    for message in messages:
+        appended = []  # type: List[MutableSequence[Any]]
+        try:
+            # Lazy messages are decoded here, once per flush.
+            body = message.body
+            for name, column in columns.items():
+                column.append(body[name])
+                appended.append(column)
+        except (json.JSONDecodeError, UnicodeDecodeError, LookupError, DecompressionError, TypeError, OverflowError):
+            for column in appended:
+                column.pop()
+            invalid.append(message)
+        else:
+            rows.append(message)
+
+    return ColumnarBatch(columns, rows), invalid
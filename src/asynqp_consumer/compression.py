@@ -0,0 +1,73 @@
+import gzip
+import zlib
+from typing import Callable, Dict, Optional
+
+import asynqp
+
+
+Decompressor = Callable[[bytes], bytes]
+
+
+class DecompressionError(Exception):
+    pass
+
+
+_decompressors = {
+    'gzip': gzip.decompress,
+    'x-gzip': gzip.decompress,
+    'deflate': zlib.decompress,
+    'identity': bytes,
+}  # type: Dict[str, Decompressor]
+
+
+def register_decompressor(content_encoding: str, decompressor: Decompressor) -> None:
+    _decompressors[content_encoding.lower()] = decompressor
+
+
+def get_decompressor(content_encoding: Optional[str]) -> Optional[Decompressor]:
+    if not content_encoding:
+        return None
+    return _decompressors.get(content_encoding.lower())
+
+
+def is_compressed(message: asynqp.IncomingMessage) -> bool:
+    return get_decompressor(message.content_encoding) is not None
+
+
+def decompress(message: asynqp.IncomingMessage) -> bytes:
+    decompressor = get_decompressor(message.content_encoding)
+    assert decompressor is not None, 'Unsupported content encoding: {}'.format(message.content_encoding)
+    try:
+        return decompressor(message.body)
+    except DecompressionError:
+        raise
+    except Exception as e:
+        raise DecompressionError('Failed to decompress {} body: {}'.format(message.content_encoding, e)) from e
+
+
+def _get_missing_decompressor(content_encoding: str, package: str) -> Decompressor:
+    # Known encodings stay registered without their package, otherwise IncomingMessage.json()
+    # would pass them to bytes.decode() and fail with LookupError.
+    def decompressor(body: bytes) -> bytes:
+        raise DecompressionError('Cannot decompress {} body: {} is not installed.'.format(content_encoding, package))
+
+    return decompressor
+
+
+def _register_optional_decompressors() -> None:
+    try:
+        import zstandard  # pylint: disable=import-error
+    except ImportError:
+        register_decompressor('zstd', _get_missing_decompressor('zstd', 'zstandard'))
+    else:
+        register_decompressor('zstd', lambda body: zstandard.ZstdDecompressor().decompressobj().decompress(body))
+
+    try:
+        import lz4.frame  # pylint: disable=import-error
+    except ImportError:
+        register_decompressor('lz4', _get_missing_decompressor('lz4', 'lz4'))
+    else:
+        register_decompressor('lz4', lz4.frame.decompress)
+
+
+_register_optional_decompressors()
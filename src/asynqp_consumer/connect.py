@@ -6,10 +6,26 @@ import asynqp
 from asynqp_consumer.records import ConnectionParams
 
 
+async def connect(
+        connection_params: ConnectionParams,
+        loop: asyncio.AbstractEventLoop = None,
+) -> asynqp.Connection:
+    loop = loop or asyncio.get_event_loop()
+    return await asynqp.connect(
+        host=connection_params.host,
+        port=connection_params.port,
+        username=connection_params.username,
+        password=connection_params.password,
+        virtual_host=connection_params.virtual_host,
+        loop=loop
+    )
+
+
 async def connect_and_open_channel(
         connection_params: ConnectionParams,
-        loop: asyncio.BaseEventLoop = None,
+        loop: asyncio.AbstractEventLoop = None,
 ) -> Tuple[asynqp.Connection, asynqp.Channel]:
+    # asynqp still requires an explicit loop, inside a coroutine get_event_loop() returns the running one
     loop = loop or asyncio.get_event_loop()
     return await asynqp.connect_and_open_channel(
         host=connection_params.host,
@@ -11,20 +11,31 @@ from typing import (
     Optional,
     Dict,
     Iterator,
+    Union,
 )
 
 import asynqp
 
+from asynqp_consumer.columnar import ColumnarBatch, Schema, decode_columns, validate_schema
+from asynqp_consumer.compression import DecompressionError, decompress, is_compressed
 from asynqp_consumer.connect import connect_and_open_channel
 from asynqp_consumer.helpers import gather
-from asynqp_consumer.message import Message
+from asynqp_consumer.manager import ConnectionManager
+from asynqp_consumer.message import Message, NoAckMessage, SpooledMessage
+from asynqp_consumer.monitor import QueueMonitor, check_monitor_support
 from asynqp_consumer.queue import declare_queue
-from asynqp_consumer.records import ConnectionParams, Queue
+from asynqp_consumer.ratelimit import TokenBucket
+from asynqp_consumer.records import ConnectionParams, Queue, QueueStats
+from asynqp_consumer.spool import Spool
 
 
 logger = logging.getLogger(__name__)
 
 
+def _get_priority(message: Message) -> int:
+    return message.priority or 0
+
+
 class ConsumerCloseException(Exception):
     pass
 
@@ -34,37 +45,127 @@ class MessagesIterator(AsyncIterator[Message]):
     def __init__(
             self,
             queue: asyncio.Queue,
-            mq_queue: asynqp.Queue,
-            consume_arguments: Optional[Dict[str, Any]] = None
+            mq_queues: List[asynqp.Queue],
+            consume_arguments: Optional[Dict[str, Any]] = None,
+            no_ack: bool = False,
+            buffer_size: int = 0,
+            on_drop: Optional[Callable[[], None]] = None,
+            rate_limit: Optional[TokenBucket] = None,
     ) -> None:
         self._queue = queue
-        self._mq_queue = mq_queue
+        self._mq_queues = mq_queues
         self._consume_arguments = consume_arguments
+        self._no_ack = no_ack
+        self._buffer_size = buffer_size
+        self._on_drop = on_drop
+        self._rate_limit = rate_limit
+        self._consumers = []  # type: List[asynqp.queue.Consumer]
+        self._pausing = None  # type: Optional[asyncio.Future]
+        # A pause started while consume() subscribes waits for it, so it cancels every consumer.
+        self._subscribing = asyncio.Lock()
+
+    @property
+    def paused(self) -> bool:
+        return self._pausing is not None
 
     async def consume(self):
-        await self._mq_queue.consume(callback=self._queue.put_nowait, arguments=self._consume_arguments)
+        callback = self._put if self._buffer_size else self._queue.put_nowait
+        async with self._subscribing:
+            for mq_queue in self._mq_queues:
+                self._consumers.append(await mq_queue.consume(
+                    callback=callback,
+                    no_ack=self._no_ack,
+                    arguments=self._consume_arguments,
+                ))
+
+    async def close(self) -> None:
+        if self._pausing is not None:
+            self._pausing.cancel()
+            await asyncio.gather(self._pausing, return_exceptions=True)
+            self._pausing = None
+
+    def _put(self, message: asynqp.IncomingMessage) -> None:
+        # Without acks the broker does not stop at prefetch_count, so consuming is paused with basic.cancel
+        # once the buffer is full. Deliveries already in flight are still buffered.
+        if self._queue.qsize() >= self._buffer_size:
+            if self._on_drop is not None:
+                self._on_drop()
+                return
+            if not self.paused:
+                logger.info('Messages buffer is full, pausing consumption.')
+                self._pausing = asyncio.ensure_future(self._cancel())
+
+        self._queue.put_nowait(message)
+
+    async def _cancel(self) -> None:
+        async with self._subscribing:
+            consumers, self._consumers = self._consumers, []
+            for consumer in consumers:
+                await consumer.cancel()
+
+    async def _resume(self) -> None:
+        # Cleared before subscribing again, so deliveries arriving during consume() can pause it again.
+        await self._pausing
+        self._pausing = None
+        await self.consume()
+        logger.info('Messages buffer drained, consumption resumed.')
 
     def __aiter__(self):
         return self
 
     async def __anext__(self):
-        return await self._queue.get()
+        # The token is taken before the delivery, so while throttled deliveries stay unacked in the local queue
+        # and the broker stops sending once the prefetch window is full.
+        if self._rate_limit is not None:
+            await self._rate_limit.acquire()
+        message = await self._queue.get()
+        if self.paused and self._queue.qsize() <= self._buffer_size // 2:
+            await self._resume()
+        return message
 
 
 class Consumer:
 
     RECONNECT_TIMEOUT = 3  # seconds
+    ACK_MODES = ('ack', 'none')
+    SPOOL_BATCH_SIZE = 100
 
-    def __init__(
+    def __init__(  # pylint: disable=too-many-locals
             self,
             queue: Queue,
-            callback: Callable[[List[Message]], Coroutine[Any, Any, None]],
+            callback: Callable[[Union[List[Message], ColumnarBatch]], Coroutine[Any, Any, None]],
             connection_params: List[ConnectionParams] = None,
             prefetch_count: int = 0,
             check_bulk_interval: float = 0.3,
             consume_arguments: Optional[Dict[str, Any]] = None,
             reject_invalid_json: bool = True,
+            monitor_interval: Optional[float] = None,
+            on_queue_stats: Optional[Callable[[QueueStats], Coroutine[Any, Any, None]]] = None,
+            max_prefetch_count: Optional[int] = None,
+            decompress_in_executor_threshold: Optional[int] = None,
+            columns: Optional[Schema] = None,
+            urgent_priority: Optional[int] = None,
+            messages_rate_limit: Optional[TokenBucket] = None,
+            batches_rate_limit: Optional[TokenBucket] = None,
+            spool: Optional[Spool] = None,
+            channels: int = 1,
+            connection_manager: Optional[ConnectionManager] = None,
+            ack_mode: str = 'ack',
+            no_ack_buffer_size: int = 10000,
+            drop_overflow: bool = False,
     ) -> None:
+        assert ack_mode in self.ACK_MODES, 'ack_mode must be one of {}.'.format(', '.join(self.ACK_MODES))
+        assert channels >= 1, 'At least one channel is required.'
+        assert not max_prefetch_count or monitor_interval, 'Prefetch autoscaling requires monitor_interval.'
+        assert not max_prefetch_count or 0 < prefetch_count <= max_prefetch_count, \
+            'Prefetch autoscaling requires 0 < prefetch_count <= max_prefetch_count.'
+        assert not messages_rate_limit or prefetch_count > 0 or ack_mode == 'none', \
+            'Messages rate limit requires prefetch_count > 0 or ack_mode none to bound the local buffer.'
+        if monitor_interval:
+            check_monitor_support()
+        if columns is not None:
+            validate_schema(columns)
+
         self.queue = queue
         self.callback = callback
         self.connection_params = connection_params or [ConnectionParams()]
@@ -72,130 +173,348 @@ class Consumer:
         self.prefetch_count = prefetch_count
         self.check_bulk_interval = check_bulk_interval
         self.reject_invalid_json = reject_invalid_json
+        self.monitor_interval = monitor_interval
+        self.on_queue_stats = on_queue_stats
+        self.max_prefetch_count = max_prefetch_count
+        self.decompress_in_executor_threshold = decompress_in_executor_threshold
+        self.columns = columns
+        self.urgent_priority = urgent_priority
+        self.messages_rate_limit = messages_rate_limit
+        self.batches_rate_limit = batches_rate_limit
+        self.spool = spool
+        self.channels = channels
+        self.connection_manager = connection_manager
+        self.ack_mode = ack_mode
+        self.no_ack_buffer_size = no_ack_buffer_size
+        self.drop_overflow = drop_overflow
+        self.dropped = 0
 
         self._connection_params_iterator = cycle(self.connection_params)  # type: Iterator[ConnectionParams]
         self._connection = None  # type: Optional[asynqp.Connection]
         self._channel = None  # type: Optional[asynqp.Channel]
         self._queue = None  # type: Optional[asynqp.Queue]
+        self._channels = []  # type: List[asynqp.Channel]
+        self._monitor_channel = None  # type: Optional[asynqp.Channel]
+        self._messages_iterator = None  # type: Optional[MessagesIterator]
+        self._queues = []  # type: List[asynqp.Queue]
         self._reconnect_attempts = 0
+        self._no_ack = ack_mode == 'none'
+        self._prefetch_count = prefetch_count
         self._messages = []  # type: List[Message]
-        self._messages_lock = asyncio.Lock()
+        self._messages_lock = None  # type: Optional[asyncio.Lock]
+        self._spool_lock = None  # type: Optional[asyncio.Lock]
+        self._spool_appended = None  # type: Optional[asyncio.Event]
+        self._spool_task = None  # type: Optional[asyncio.Future]
         self._closed = None  # type: Optional[asyncio.Future]
 
-    async def start(self, loop: asyncio.BaseEventLoop = None) -> None:
+    async def start(self) -> None:
         assert not self._closed, 'Consumer already started.'
 
-        self._closed = asyncio.Future(loop=loop)
+        self._closed = asyncio.Future()
+        self._messages_lock = asyncio.Lock()
 
-        while not self._closed.done():
-            try:
-                await self._connect(loop=loop)
-                await gather(
-                    self._closed,
-                    self._connection.closed,
-                    self._process_queue(loop=loop),
-                    self._check_bulk(loop=loop),
-                    loop=loop
-                )
+        if self.spool is not None:
+            self._spool_lock = asyncio.Lock()
+            self._spool_appended = asyncio.Event()
+            self._spool_task = asyncio.ensure_future(self._process_spool())
+            self._spool_task.add_done_callback(self._on_spool_task_done)
 
-            except (asynqp.AMQPConnectionError, OSError) as e:
-                logger.exception(str(e))
+        try:
+            while not self._closed.done():
+                try:
+                    await self._connect()
+                    tasks = [
+                        self._closed,
+                        # The connection may be shared through a connection manager, cancelling this consumer
+                        # must not cancel the future other consumers of the connection wait on.
+                        asyncio.shield(self._connection.closed),
+                        self._process_queue(),
+                        self._check_bulk(),
+                    ]
+                    if self.monitor_interval:
+                        tasks.append(self._monitor_queue())
+                    await gather(*tasks)
 
-                self._reconnect_attempts += 1
-                timeout = self.RECONNECT_TIMEOUT * min(self._reconnect_attempts, 10)
+                except (asynqp.AMQPConnectionError, OSError) as e:
+                    logger.exception(str(e))
 
-                logger.info('Trying to recconnect in %d seconds.', timeout)
+                    self._reconnect_attempts += 1
+                    timeout = self.RECONNECT_TIMEOUT * min(self._reconnect_attempts, 10)
 
-                await asyncio.sleep(timeout, loop=loop)
+                    logger.info('Trying to recconnect in %d seconds.', timeout)
 
-            except ConsumerCloseException:
-                pass
+                    await asyncio.sleep(timeout)
 
-        await self._disconnect()
-        self._closed = None
+                except ConsumerCloseException:
+                    pass
+
+            if self._spool_task is not None and self._spool_task.done():
+                self._spool_task.result()
+
+        finally:
+            await self._shutdown()
 
     def close(self) -> None:
         self._closed.set_exception(ConsumerCloseException)
 
-    async def _connect(self, loop: asyncio.BaseEventLoop) -> None:
-        connection_params = next(self._connection_params_iterator)
+    async def _shutdown(self) -> None:
+        if self._closed is None:
+            return
 
-        logger.info('Connection params: %s', connection_params)
+        if self._spool_task is not None:
+            self._spool_task.cancel()
+            self._spool_task = None
 
-        self._connection, self._channel = await connect_and_open_channel(connection_params, loop)
+        await self._disconnect()
+        self._closed = None
+
+    async def _connect(self) -> None:
+        if self.connection_manager is not None:
+            self._connection, self._channel = await self.connection_manager.open_channel()
+        else:
+            connection_params = next(self._connection_params_iterator)
+
+            logger.info('Connection params: %s', connection_params)
+
+            self._connection, self._channel = await connect_and_open_channel(connection_params)
 
         logger.info('Connection and channel are ready.')
 
-        await self._channel.set_qos(prefetch_count=self.prefetch_count)
+        await self._channel.set_qos(prefetch_count=self._prefetch_count)
 
         self._queue = await declare_queue(self._channel, self.queue)
 
+        self._channels = [self._channel]
+        self._queues = [self._queue]
+        for _ in range(self.channels - 1):
+            channel = await self._connection.open_channel()
+            await channel.set_qos(prefetch_count=self._prefetch_count)
+            self._channels.append(channel)
+            self._queues.append(await channel.declare_queue(self._queue.name, passive=True))
+
         logger.info('Queue is ready.')
 
         self._reconnect_attempts = 0
 
     async def _disconnect(self) -> None:
-        if self._channel:
-            await self._channel.close()
+        if self._messages_iterator is not None:
+            await self._messages_iterator.close()
+            self._messages_iterator = None
 
-        if self._connection:
+        if self._monitor_channel is not None:
+            await self._monitor_channel.close()
+            self._monitor_channel = None
+
+        for channel in self._channels:
+            await channel.close()
+
+        if self._connection and self.connection_manager is None:
             await self._connection.close()
 
-    async def _process_queue(self, loop: asyncio.BaseEventLoop) -> None:
+    async def _process_queue(self) -> None:
         self._messages = []
-        messages_iterator = await self._get_messages_iterator(loop=loop)
+        messages_iterator = await self._get_messages_iterator()
 
         async for message in messages_iterator:
             try:
-                wrapper = Message(message)
-            except json.JSONDecodeError:
+                wrapper = await self._create_message(message)
+            except (json.JSONDecodeError, UnicodeDecodeError, LookupError, DecompressionError):
                 logger.exception('Failed to parse message body: %s', message.body)
+                if self._no_ack:
+                    continue
                 if self.reject_invalid_json:
                     message.reject(requeue=True)
                 else:
                     message.ack()
                 continue
 
+            if self._is_urgent(wrapper):
+                await self._process_messages([wrapper])
+                continue
+
             self._messages.append(wrapper)
 
-            if self.prefetch_count != 0:
+            if self._prefetch_count != 0:
                 await self._process_bulk()
 
-    async def _get_messages_iterator(self, loop: asyncio.BaseEventLoop) -> AsyncIterator[asynqp.IncomingMessage]:
-        messages_queue = asyncio.Queue(loop=loop)
+    async def _create_message(self, message: asynqp.IncomingMessage) -> Message:
+        # In columns mode bodies are decoded once when the batch is flushed, see decode_columns.
+        message_class = NoAckMessage if self._no_ack else Message
+        lazy = self.columns is not None
+        threshold = self.decompress_in_executor_threshold
+        if threshold is not None and is_compressed(message) and len(message.body) >= threshold:
+            decompressed_body = await asyncio.get_event_loop().run_in_executor(None, decompress, message)
+            return message_class(message, decompressed_body, lazy=lazy)
+        return message_class(message, lazy=lazy)
+
+    def _is_urgent(self, message: Message) -> bool:
+        return self.urgent_priority is not None and _get_priority(message) >= self.urgent_priority
+
+    async def _get_messages_iterator(self) -> AsyncIterator[asynqp.IncomingMessage]:
+        messages_queue = asyncio.Queue()  # type: asyncio.Queue
 
         iterator = MessagesIterator(
             queue=messages_queue,
-            mq_queue=self._queue,
-            consume_arguments=self.consume_arguments
+            mq_queues=self._queues,
+            consume_arguments=self.consume_arguments,
+            no_ack=self._no_ack,
+            buffer_size=self.no_ack_buffer_size if self._no_ack else 0,
+            on_drop=self._drop_message if self.drop_overflow else None,
+            rate_limit=self.messages_rate_limit,
         )
+        self._messages_iterator = iterator
         await iterator.consume()
 
         return iterator
 
-    async def _check_bulk(self, loop: asyncio.BaseEventLoop) -> None:
+    def _drop_message(self) -> None:
+        self.dropped += 1
+        if self.dropped % 1000 == 1:
+            logger.warning('Messages buffer is full, %d messages dropped so far.', self.dropped)
+
+    async def _check_bulk(self) -> None:
         while True:
-            await asyncio.sleep(self.check_bulk_interval, loop=loop)
+            await asyncio.sleep(self.check_bulk_interval)
             asyncio.ensure_future(self._process_bulk(force=True))
 
+    async def _monitor_queue(self) -> None:
+        self._monitor_channel = await self._connection.open_channel()
+        monitor = QueueMonitor(self._monitor_channel, self._queue.name)
+
+        while True:
+            await asyncio.sleep(self.monitor_interval)
+            stats = await monitor.get_stats()
+
+            logger.debug('Queue stats: %s', stats)
+
+            if self.on_queue_stats is not None:
+                try:
+                    await self.on_queue_stats(stats)
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.exception(e)
+
+            if self.max_prefetch_count:
+                await self._scale_prefetch_count(stats)
+
+    async def _scale_prefetch_count(self, stats: QueueStats) -> None:
+        prefetch_count = self._prefetch_count
+        if stats.message_count > prefetch_count and (stats.drain_rate is None or stats.drain_rate <= 0):
+            prefetch_count = min(prefetch_count * 2, self.max_prefetch_count)
+        elif stats.message_count == 0:
+            prefetch_count = max(prefetch_count // 2, self.prefetch_count)
+
+        if prefetch_count == self._prefetch_count:
+            return
+
+        logger.info('Scaling prefetch count from %d to %d, %d messages in queue.',
+                    self._prefetch_count, prefetch_count, stats.message_count)
+
+        for channel in self._channels:
+            await channel.set_qos(prefetch_count=prefetch_count)
+        self._prefetch_count = prefetch_count
+
     async def _process_bulk(self, force: bool = False) -> None:
         to_process = []  # type: List[Message]
 
-        with await self._messages_lock:
-            count = self.prefetch_count if self.prefetch_count != 0 else len(self._messages)
+        async with self._messages_lock:
+            count = self._prefetch_count if self._prefetch_count != 0 else len(self._messages)
             if force or len(self._messages) >= count:
                 to_process = self._messages[:count]
                 del self._messages[:count]
 
-        if not to_process:
+        if to_process:
+            await self._process_messages(to_process)
+
+    async def _process_messages(self, to_process: List[Message]) -> None:
+        if self.spool is not None:
+            await self._spool_messages(to_process)
             return
 
+        if self.batches_rate_limit is not None:
+            await self.batches_rate_limit.acquire()
+
         try:
-            await self.callback(to_process)
+            await self._call_callback(to_process)
         except Exception as e:  # pylint: disable=broad-except
             logger.exception(e)
-            for message in to_process:
-                message.reject()
+            if not self._no_ack:
+                for message in to_process:
+                    message.reject()
         else:
-            for message in to_process:
+            if not self._no_ack:
+                for message in to_process:
+                    message.ack()
+
+    async def _call_callback(self, messages: List[Message]) -> None:
+        if self.columns is not None:
+            batch = self._decode_columns(messages)
+            if batch:
+                await self.callback(batch)
+        else:
+            await self.callback(messages)
+
+    async def _spool_messages(self, messages: List[Message]) -> None:
+        records = [(message.raw_body, message.content_encoding) for message in messages]
+
+        try:
+            async with self._spool_lock:
+                await asyncio.get_event_loop().run_in_executor(None, self.spool.append, records)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception(e)
+            for message in messages:
+                message.reject()
+            return
+
+        for message in messages:
+            message.ack()
+
+        self._spool_appended.set()
+
+    def _on_spool_task_done(self, task: asyncio.Future) -> None:
+        # Deliveries are acked as soon as they are spooled, so consuming without the reader would lose them.
+        # start() re-raises the reader's error after closing.
+        if task.cancelled():
+            return
+        logger.error('Spool reader failed, closing consumer.', exc_info=task.exception())
+        if self._closed is not None and not self._closed.done():
+            self.close()
+
+    async def _process_spool(self) -> None:
+        self.spool.rewind()
+        loop = asyncio.get_event_loop()
+
+        while True:
+            self._spool_appended.clear()
+            # Spool calls block on its lock while an append runs in the executor, keep them off the loop.
+            records = await loop.run_in_executor(None, self.spool.read, self._prefetch_count or self.SPOOL_BATCH_SIZE)
+            if not records:
+                await self._spool_appended.wait()
+                continue
+
+            messages = [
+                SpooledMessage(record, lazy=self.columns is not None) for record in records
+            ]  # type: List[Message]
+            while True:
+                if self.batches_rate_limit is not None:
+                    await self.batches_rate_limit.acquire()
+                try:
+                    await self._call_callback(messages)
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.exception(e)
+                    await asyncio.sleep(self.RECONNECT_TIMEOUT)
+                else:
+                    break
+
+            await loop.run_in_executor(None, self.spool.commit, records[-1].position)
+
+    def _decode_columns(self, messages: List[Message]) -> ColumnarBatch:
+        batch, invalid = decode_columns(messages, self.columns)
+
+        for message in invalid:
+            logger.error('Message body does not match columns schema: %s', message.raw_body)
+            if self.reject_invalid_json:
+                message.reject(requeue=True)
+            else:
                 message.ack()
+
+        return batch
@@ -3,11 +3,32 @@ from collections.abc import Coroutine
 from typing import Any, Awaitable
 
 
-async def gather(*coros_or_futures: Awaitable[Any], loop: asyncio.BaseEventLoop = None):
+class _Interrupted(Exception):
+
+    def __init__(self, interrupt: BaseException) -> None:
+        super().__init__(interrupt)
+        self.interrupt = interrupt
+
+
+async def _interruptible(coro: Awaitable[Any]) -> Any:
+    # Python 3.7 never resumes a task whose awaited future failed with KeyboardInterrupt or SystemExit,
+    # so they are carried to the gathering task as an ordinary exception and re-raised there.
+    try:
+        return await coro
+    except (KeyboardInterrupt, SystemExit) as e:
+        raise _Interrupted(e) from e
+
+
+async def gather(*coros_or_futures: Awaitable[Any]):
     try:
-        return await asyncio.gather(*coros_or_futures, loop=loop)
-    except Exception:
+        return await asyncio.gather(*(
+            _interruptible(obj) if isinstance(obj, Coroutine) else obj
+            for obj in coros_or_futures
+        ))
+    except Exception as e:
         for obj in coros_or_futures:
             if isinstance(obj, Coroutine):
                 obj.close()
+        if isinstance(e, _Interrupted):
+            raise e.interrupt from None
         raise
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from itertools import cycle
+from typing import Iterator, List, Optional, Tuple  # pylint: disable=unused-import
+
+import asynqp
+
+from asynqp_consumer.connect import connect
+from asynqp_consumer.records import ConnectionParams
+
+
+logger = logging.getLogger(__name__)
+
+
+def _is_alive(connection: asynqp.Connection) -> bool:
+    # The transport is closed before asynqp resolves `closed`, and is_closed() also covers a close in progress.
+    return not connection.is_closed() and not connection.transport.is_closing()
+
+
+class ConnectionManager:
+
+    RECONNECT_TIMEOUT = 3  # seconds
+
+    def __init__(self, connection_params: List[ConnectionParams] = None, size: int = 1) -> None:
+        assert size >= 1, 'At least one connection is required.'
+
+        self.connection_params = connection_params or [ConnectionParams()]
+        self.size = size
+
+        self._connection_params_iterator = cycle(self.connection_params)  # type: Iterator[ConnectionParams]
+        self._slots = cycle(range(size))  # type: Iterator[int]
+        self._connections = [None] * size  # type: List[Optional[asynqp.Connection]]
+        self._failures = [None] * size  # type: List[Optional[Tuple[float, Exception]]]
+        self._locks = None  # type: Optional[List[asyncio.Lock]]
+
+    async def open_channel(self) -> Tuple[asynqp.Connection, asynqp.Channel]:
+        slot = next(self._slots)
+        connection = await self._get_connection(slot)
+        try:
+            channel = await connection.open_channel()
+        except (asynqp.AMQPConnectionError, OSError):
+            # A connection that cannot open channels is not handed out again, the next caller reconnects.
+            if self._connections[slot] is connection:
+                self._connections[slot] = None
+            raise
+        return connection, channel
+
+    async def close(self) -> None:
+        connections, self._connections = self._connections, [None] * self.size
+        for connection in connections:
+            if connection is not None and not connection.closed.done():
+                await connection.close()
+
+    async def _get_connection(self, slot: int) -> asynqp.Connection:
+        if self._locks is None:
+            self._locks = [asyncio.Lock() for _ in range(self.size)]
+
+        # Consumers sharing a dropped connection all come here at once, only the first one reconnects.
+        async with self._locks[slot]:
+            connection = self._connections[slot]
+            if connection is not None and _is_alive(connection):
+                return connection
+
+            # While the broker is down, consumers waiting on the lock get the first attempt's error
+            # instead of each making their own attempt in turn.
+            loop = asyncio.get_event_loop()
+            failure = self._failures[slot]
+            if failure is not None and loop.time() < failure[0]:
+                raise failure[1]
+
+            connection_params = next(self._connection_params_iterator)
+            logger.info('Connection params: %s', connection_params)
+
+            try:
+                connection = await connect(connection_params)
+            except (asynqp.AMQPConnectionError, OSError) as e:
+                self._failures[slot] = (loop.time() + self.RECONNECT_TIMEOUT, e)
+                raise
+            self._connections[slot] = connection
+            self._failures[slot] = None
+
+            logger.info('Connection %d is ready.', slot)
+
+            return connection
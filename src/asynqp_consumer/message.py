@@ -1,14 +1,49 @@
-from typing import Any  # pylint: disable=unused-import
+import json
+from typing import Any, Optional  # pylint: disable=unused-import
 
 import asynqp
 
+from asynqp_consumer.compression import decompress, is_compressed
+from asynqp_consumer.spool import SpoolRecord
+
+
+_NOT_DECODED = object()
+
 
 class Message:
 
-    def __init__(self, message: asynqp.IncomingMessage) -> None:
-        self.body = message.json()  # type: Any
+    def __init__(
+            self,
+            message: asynqp.IncomingMessage,
+            decompressed_body: Optional[bytes] = None,
+            lazy: bool = False,
+    ) -> None:
         self._message = message
+        self._decompressed_body = decompressed_body
+        self._body = _NOT_DECODED  # type: Any
         self._is_completed = False
+        if not lazy:
+            self._decode()
+
+    @property
+    def body(self) -> Any:
+        if self._body is _NOT_DECODED:
+            self._decode()
+        return self._body
+
+    def _decode(self) -> None:
+        decompressed_body = self._decompressed_body
+        if decompressed_body is None and is_compressed(self._message):
+            decompressed_body = decompress(self._message)
+        if decompressed_body is None:
+            self._body = self._message.json()
+        else:
+            self._body = json.loads(decompressed_body.decode('utf-8'))
+        self._decompressed_body = None
+
+    @property
+    def raw_body(self) -> bytes:
+        return self._message.body
 
     def ack(self) -> None:
         if not self._is_completed:
@@ -22,3 +57,26 @@ class Message:
 
     def __getattr__(self, name):
         return getattr(self._message, name)
+
+
+class NoAckMessage(Message):
+
+    def ack(self) -> None:
+        self._is_completed = True
+
+    def reject(self, requeue: bool = True) -> None:
+        self._is_completed = True
+
+
+class SpooledMessage(NoAckMessage):
+
+    def __init__(self, record: SpoolRecord, lazy: bool = False) -> None:
+        super().__init__(asynqp.IncomingMessage(
+            body=record.body,
+            content_encoding=record.content_encoding,
+            sender=None,
+            delivery_tag=None,
+            exchange_name=None,
+            routing_key=None,
+        ), lazy=lazy)
+        self.position = record.position
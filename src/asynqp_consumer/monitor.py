@@ -0,0 +1,63 @@
+import time
+from typing import Dict, Optional, Tuple  # pylint: disable=unused-import
+
+import asynqp
+from asynqp import spec
+
+from asynqp_consumer.records import QueueStats
+
+
+class QueueMonitorError(Exception):
+    pass
+
+
+def check_monitor_support() -> None:
+    # The counts are read through asynqp internals, checked against asynqp 0.5.1 and 0.6.
+    if not hasattr(asynqp.channel.ChannelActor, 'handle_QueueDeclareOK') \
+            or not hasattr(asynqp.routing.Synchroniser, 'notify'):
+        raise QueueMonitorError('Queue monitoring is not supported by the installed asynqp version.')
+
+
+class QueueMonitor:
+
+    def __init__(self, channel: asynqp.Channel, queue_name: str) -> None:
+        self._channel = channel
+        self._queue_name = queue_name
+        self._counts = {}  # type: Dict[str, Tuple[int, int]]
+        self._previous = None  # type: Optional[Tuple[float, int]]
+
+        # asynqp drops message and consumer counts of queue.declare-ok, so the channel has to be dedicated
+        # to the monitor: the counts are stored before the waiting declare_queue call is notified.
+        actor = getattr(getattr(channel, 'reader', None), 'handler', None)
+        synchroniser = getattr(actor, 'synchroniser', None)
+        if synchroniser is None or not hasattr(actor, 'handle_QueueDeclareOK'):
+            raise QueueMonitorError('Queue monitoring is not supported by the installed asynqp version.')
+
+        def handle_queue_declare_ok(frame):
+            payload = frame.payload
+            self._counts[payload.queue] = (payload.message_count, payload.consumer_count)
+            synchroniser.notify(spec.QueueDeclareOK, payload.queue)  # pylint: disable=no-member
+
+        actor.handle_QueueDeclareOK = handle_queue_declare_ok
+
+    async def get_stats(self) -> QueueStats:
+        await self._channel.declare_queue(self._queue_name, passive=True)
+        message_count, consumer_count = self._counts.pop(self._queue_name)
+
+        now = time.monotonic()
+        drain_rate = None
+        eta = 0.0 if message_count == 0 else None
+        if self._previous is not None:
+            previous_time, previous_count = self._previous
+            if now > previous_time:
+                drain_rate = (previous_count - message_count) / (now - previous_time)
+                if message_count and drain_rate > 0:
+                    eta = message_count / drain_rate
+        self._previous = (now, message_count)
+
+        return QueueStats(
+            message_count=message_count,
+            consumer_count=consumer_count,
+            drain_rate=drain_rate,
+            eta=eta,
+        )
@@ -0,0 +1,29 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        assert rate > 0, 'Rate must be positive.'
+        self.rate = rate
+        self.burst = float(burst) if burst is not None else max(rate, 1.0)
+        assert self.burst > 0, 'Burst must be positive.'
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _reserve(self, tokens: float) -> float:
+        # Tokens are taken immediately and may go negative, so waiters are served in order
+        # and one bucket can be shared by several consumers without a lock.
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= tokens
+        return -self._tokens / self.rate if self._tokens < 0 else 0.0
@@ -1,5 +1,5 @@
 from abc import ABCMeta
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 from urllib.parse import urlparse
 
 
@@ -91,3 +91,15 @@ class ConnectionParams(BaseObject):
         if parse_result.password:
             kwargs['password'] = parse_result.password
         return cls(**kwargs)
+
+
+class QueueStats(BaseObject):
+
+    __slots__ = ['message_count', 'consumer_count', 'drain_rate', 'eta']
+
+    def __init__(self, message_count: int, consumer_count: int, drain_rate: Optional[float] = None,
+                 eta: Optional[float] = None):
+        self.message_count = message_count
+        self.consumer_count = consumer_count
+        self.drain_rate = drain_rate  # messages per second, negative when the queue grows
+        self.eta = eta  # seconds until the queue is empty at the current drain rate
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+from asynqp_consumer.consumer import Consumer
+
+
+logger = logging.getLogger(__name__)
+
+
+def install_uvloop() -> bool:
+    try:
+        import uvloop  # pylint: disable=import-error
+    except ImportError:
+        logger.info('uvloop is not installed, using default event loop.')
+        return False
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logger.info('uvloop event loop policy installed.')
+    return True
+
+
+def run(consumer: Consumer, use_uvloop: bool = True) -> None:
+    # install_uvloop() changes the process-wide policy, so the previous one is restored on exit.
+    policy = asyncio.get_event_loop_policy()
+    if use_uvloop:
+        install_uvloop()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    task = loop.create_task(consumer.start())
+    try:
+        loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        # If KeyboardInterrupt was raised inside the consumer, start() has already shut it down.
+        if not task.done():
+            consumer.close()
+            loop.run_until_complete(task)
+    finally:
+        _cancel_pending_tasks(loop)
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
+        asyncio.set_event_loop_policy(policy)
+
+
+def _cancel_pending_tasks(loop: asyncio.AbstractEventLoop) -> None:
+    all_tasks = getattr(asyncio, 'all_tasks', asyncio.Task.all_tasks)
+    tasks = [task for task in all_tasks(loop) if not task.done()]
+    if not tasks:
+        return
+
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
@@ -0,0 +1,227 @@
+import errno
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple  # pylint: disable=unused-import
+
+
+# Segment index and offset right after a record.
+Position = Tuple[int, int]
+
+SpoolRecord = NamedTuple('SpoolRecord', [
+    ('body', bytes),
+    ('content_encoding', Optional[str]),
+    ('position', Position),
+])
+
+
+class Spool:
+    SEGMENT_SUFFIX = '.log'
+    TEMP_SUFFIX = '.tmp'
+    CHECKPOINT_FILE = 'checkpoint'
+
+    _MAGIC = 0xA5
+    _HEADER = struct.Struct('>BIIB')  # magic, body length, crc32, content encoding length
+    _CHECKPOINT = struct.Struct('>QQ')
+
+    def __init__(self, directory: str, segment_size: int = 64 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.segment_size = segment_size
+
+        os.makedirs(directory, exist_ok=True)
+        self._remove_temp_files()
+
+        # append() runs in an executor thread while read() and commit() may run elsewhere.
+        self._lock = threading.Lock()
+        self._checkpoint = self._load_checkpoint()  # type: Position
+        self._read_position = self._checkpoint  # type: Position
+        self._maps = {}  # type: Dict[int, mmap.mmap]
+
+        segments = self._list_segments()
+        self._write_segment = segments[-1] if segments else self._checkpoint[0]
+        # A segment too short to hold a record has no records, but mmap refuses an empty file.
+        if not segments or os.path.getsize(self._segment_path(self._write_segment)) < self._HEADER.size:
+            self._create_segment(self._write_segment, self.segment_size)
+        self._write_offset = self._find_end(self._write_segment)
+
+    def append(self, records: Iterable[Tuple[bytes, Optional[str]]]) -> None:
+        with self._lock:
+            self._append(records)
+
+    def _append(self, records: Iterable[Tuple[bytes, Optional[str]]]) -> None:
+        for body, content_encoding in records:
+            encoding = (content_encoding or '').encode('ascii')
+            size = self._HEADER.size + len(encoding) + len(body)
+
+            if self._write_offset + size > len(self._get_map(self._write_segment)):
+                self._get_map(self._write_segment).flush()
+                self._create_segment(self._write_segment + 1, max(self.segment_size, size))
+                self._write_segment += 1
+                self._write_offset = 0
+
+            segment_map = self._get_map(self._write_segment)
+            offset = self._write_offset
+            crc = zlib.crc32(body, zlib.crc32(encoding))
+            self._HEADER.pack_into(segment_map, offset, self._MAGIC, len(body), crc, len(encoding))
+            offset += self._HEADER.size
+            segment_map[offset:offset + len(encoding)] = encoding
+            offset += len(encoding)
+            segment_map[offset:offset + len(body)] = body
+            self._write_offset = offset + len(body)
+
+        self._get_map(self._write_segment).flush()
+
+    def read(self, max_count: int) -> List[SpoolRecord]:
+        with self._lock:
+            return self._read(max_count)
+
+    def _read(self, max_count: int) -> List[SpoolRecord]:
+        result = []  # type: List[SpoolRecord]
+        segment, offset = self._read_position
+
+        while len(result) < max_count:
+            if segment == self._write_segment and offset >= self._write_offset:
+                break
+
+            record = self._read_record(segment, offset)
+            if record is None:
+                if segment >= self._write_segment:
+                    break
+                segment, offset = segment + 1, 0
+                continue
+
+            result.append(record)
+            segment, offset = record.position
+
+        self._read_position = (segment, offset)
+        return result
+
+    def commit(self, position: Position) -> None:
+        with self._lock:
+            self._commit(position)
+
+    def _commit(self, position: Position) -> None:
+        path = os.path.join(self.directory, self.CHECKPOINT_FILE)
+        temp_path = path + self.TEMP_SUFFIX
+        with open(temp_path, 'wb') as f:
+            f.write(self._CHECKPOINT.pack(*position))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        self._fsync_directory()
+        self._checkpoint = position
+
+        for segment in self._list_segments():
+            if segment < position[0]:
+                self._close_map(segment)
+                os.remove(self._segment_path(segment))
+
+    def rewind(self) -> None:
+        with self._lock:
+            self._read_position = self._checkpoint
+
+    def close(self) -> None:
+        with self._lock:
+            for segment in list(self._maps):
+                self._close_map(segment)
+
+    def _read_record(self, segment: int, offset: int) -> Optional[SpoolRecord]:
+        segment_map = self._get_map(segment)
+        if offset + self._HEADER.size > len(segment_map):
+            return None
+
+        magic, body_length, crc, encoding_length = self._HEADER.unpack_from(segment_map, offset)
+        start = offset + self._HEADER.size
+        end = start + encoding_length + body_length
+        if magic != self._MAGIC or end > len(segment_map):
+            return None
+
+        encoding = segment_map[start:start + encoding_length]
+        body = segment_map[start + encoding_length:end]
+        if zlib.crc32(body, zlib.crc32(encoding)) != crc:
+            return None
+
+        return SpoolRecord(body=body, content_encoding=encoding.decode('ascii') or None, position=(segment, end))
+
+    def _find_end(self, segment: int) -> int:
+        offset = 0
+        while True:
+            record = self._read_record(segment, offset)
+            if record is None:
+                return offset
+            offset = record.position[1]
+
+    def _load_checkpoint(self) -> Position:
+        try:
+            with open(os.path.join(self.directory, self.CHECKPOINT_FILE), 'rb') as f:
+                segment, offset = self._CHECKPOINT.unpack(f.read())
+        except FileNotFoundError:
+            segments = self._list_segments()
+            return (segments[0] if segments else 0, 0)
+        return segment, offset
+
+    def _list_segments(self) -> List[int]:
+        return sorted(
+            int(name[:-len(self.SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(self.SEGMENT_SUFFIX)
+        )
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, '{:020d}{}'.format(segment, self.SEGMENT_SUFFIX))
+
+    def _remove_temp_files(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SEGMENT_SUFFIX + self.TEMP_SUFFIX):
+                os.remove(os.path.join(self.directory, name))
+
+    def _create_segment(self, segment: int, size: int) -> None:
+        # Blocks are allocated up front: writing to a sparse file through mmap on a full disk
+        # kills the process with SIGBUS instead of raising OSError here. The segment only appears
+        # under its name once fully allocated, so a crash cannot leave a short segment behind.
+        path = self._segment_path(segment)
+        temp_path = path + self.TEMP_SUFFIX
+        try:
+            with open(temp_path, 'wb') as f:
+                self._allocate(f.fileno(), size)
+                os.fsync(f.fileno())
+        except OSError:
+            os.remove(temp_path)
+            raise
+        os.replace(temp_path, path)
+        self._fsync_directory()
+
+    @staticmethod
+    def _allocate(fd: int, size: int) -> None:
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, size)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+
+        chunk = bytes(min(size, 1024 * 1024))
+        written = 0
+        while written < size:
+            written += os.write(fd, chunk[:size - written])
+
+    def _get_map(self, segment: int) -> mmap.mmap:
+        if segment not in self._maps:
+            with open(self._segment_path(segment), 'r+b') as f:
+                self._maps[segment] = mmap.mmap(f.fileno(), 0)
+        return self._maps[segment]
+
+    def _close_map(self, segment: int) -> None:
+        segment_map = self._maps.pop(segment, None)
+        if segment_map is not None:
+            segment_map.close()
+
+    def _fsync_directory(self) -> None:
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
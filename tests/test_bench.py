@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+import pytest
+
+from asynqp_consumer.bench import Broker, get_rss, main, parse_args, run_bench
+
+
+@pytest.mark.asyncio
+async def test_broker__delivery_window_and_redelivery():
+    # arrange
+    broker = Broker(lambda message_id, published_at: str(message_id).encode())
+    _, channel = await broker.open_channel()
+    await channel.set_qos(prefetch_count=2)
+    queue = await channel.declare_queue('bench')
+    delivered = []
+    await queue.consume(callback=delivered.append)
+
+    # act
+    broker.publish(3)
+    delivered[0].ack()
+    delivered[1].reject(requeue=True)
+
+    # assert
+    assert [m.body for m in delivered] == [b'0', b'1', b'2', b'1']
+    assert broker.acked == 1
+    assert broker.redelivered == 1
+    assert broker.backlog == 0
+    assert channel.unacked_count == 2
+
+
+def test_get_rss__without_proc(mocker):
+    # arrange
+    mocker.patch('asynqp_consumer.bench.open', side_effect=OSError, create=True)
+
+    # act
+    rss = get_rss()
+
+    # assert
+    assert rss > 0
+
+
+@pytest.mark.asyncio
+async def test_run_bench():
+    # arrange
+    options = parse_args([
+        '--duration', '0.5',
+        '--rate', '200',
+        '--prefetch-count', '10',
+        '--check-bulk-interval', '0.05',
+        '--failure-rate', '0.2',
+        '--sample-interval', '0.1',
+        '--seed', '1',
+    ])
+
+    # act
+    report = await run_bench(options)
+
+    # assert
+    assert report['acked'] > 0
+    assert report['redelivered'] > 0
+    assert report['throughput'] > 0
+    assert report['latency_ms']['p50'] <= report['latency_ms']['p99'] <= report['latency_ms']['max']
+    assert report['delivery_latency_ms']['max'] <= report['latency_ms']['max']
+    assert len(report['rss']) >= 1
+
+
+@pytest.fixture
+def restore_event_loop():
+    yield
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+@pytest.mark.asyncio
+async def test_run_bench__with_ack_mode_none():
+    # arrange
+    options = parse_args([
+        '--duration', '0.3',
+        '--rate', '200',
+        '--check-bulk-interval', '0.05',
+        '--ack-mode', 'none',
+        '--sample-interval', '0.1',
+    ])
+
+    # act
+    report = await run_bench(options)
+
+    # assert
+    assert report['processed'] > 0
+    assert report['acked'] == 0
+    assert report['dropped'] == 0
+    assert report['config']['ack_mode'] == 'none'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(('drop_overflow', 'dropped'), [([], False), (['--drop-overflow'], True)])
+async def test_run_bench__with_ack_mode_none_and_full_buffer(drop_overflow, dropped):
+    # arrange
+    options = parse_args([
+        '--duration', '0.3',
+        '--rate', '0',
+        '--check-bulk-interval', '0.05',
+        '--ack-mode', 'none',
+        '--no-ack-buffer-size', '50',
+        '--sample-interval', '0.1',
+    ] + drop_overflow)
+
+    # act
+    report = await run_bench(options)
+
+    # assert
+    assert report['processed'] > 0
+    assert (report['dropped'] > 0) is dropped
+
+
+def test_main__writes_json_report(tmp_path, restore_event_loop):
+    # arrange
+    output = tmp_path / 'report.json'
+
+    # act
+    main(['--duration', '0.2', '--sample-interval', '0.1', '--output', str(output)])
+
+    # assert
+    report = json.loads(output.read_text())
+    assert report['config']['duration'] == 0.2
+    assert report['acked'] > 0
@@ -0,0 +1,81 @@
+import json
+from array import array
+
+import asynqp
+import pytest
+
+from asynqp_consumer import ColumnarBatch, Message
+from asynqp_consumer.columnar import decode_columns, validate_schema
+
+
+def make_message(mocker, body):
+    incoming_message = mocker.Mock(spec=asynqp.IncomingMessage, content_encoding=None)
+    incoming_message.json.return_value = body
+    return Message(incoming_message)
+
+
+def test_decode_columns(mocker):
+    # arrange
+    messages = [
+        make_message(mocker, {'id': 1, 'price': 1.5, 'name': 'a', 'extra': True}),
+        make_message(mocker, {'id': 2, 'price': 2.5, 'name': None}),
+    ]
+
+    # act
+    batch, invalid = decode_columns(messages, {'id': 'q', 'price': 'd', 'name': 'O'})
+
+    # assert
+    assert isinstance(batch, ColumnarBatch)
+    assert len(batch) == 2
+    assert batch['id'] == array('q', [1, 2])
+    assert batch['price'] == array('d', [1.5, 2.5])
+    assert batch['name'] == ['a', None]
+    assert batch.messages == messages
+    assert invalid == []
+
+
+@pytest.mark.parametrize('body', [
+    {'id': 3},
+    {'id': 3, 'price': 'not a number'},
+    {'id': 2 ** 64, 'price': 3.5},
+    ['not', 'an', 'object'],
+])
+def test_decode_columns__skips_invalid_rows(mocker, body):
+    # arrange
+    messages = [
+        make_message(mocker, {'id': 1, 'price': 1.5}),
+        make_message(mocker, body),
+        make_message(mocker, {'id': 2, 'price': 2.5}),
+    ]
+
+    # act
+    batch, invalid = decode_columns(messages, {'id': 'q', 'price': 'd'})
+
+    # assert
+    assert batch['id'] == array('q', [1, 2])
+    assert batch['price'] == array('d', [1.5, 2.5])
+    assert batch.messages == [messages[0], messages[2]]
+    assert invalid == [messages[1]]
+
+
+@pytest.mark.parametrize('schema', [{'id': 'Z'}, {'id': 'qq'}, {'id': 'q', 'name': ''}])
+def test_validate_schema__invalid_typecode(schema):
+    # act & assert
+    with pytest.raises(ValueError):
+        validate_schema(schema)
+
+
+def test_decode_columns__decodes_lazy_messages_once(mocker):
+    # arrange
+    incoming_messages = [mocker.Mock(spec=asynqp.IncomingMessage, content_encoding=None) for _ in range(2)]
+    incoming_messages[0].json.return_value = {'id': 1}
+    incoming_messages[1].json.side_effect = json.JSONDecodeError('message', '', 0)
+    messages = [Message(incoming_message, lazy=True) for incoming_message in incoming_messages]
+
+    # act
+    batch, invalid = decode_columns(messages, {'id': 'q'})
+
+    # assert
+    assert batch['id'] == array('q', [1])
+    assert invalid == [messages[1]]
+    incoming_messages[0].json.assert_called_once_with()
@@ -0,0 +1,89 @@
+import gzip
+import sys
+import zlib
+
+import asynqp
+import pytest
+
+from asynqp_consumer.compression import (
+    DecompressionError,
+    _register_optional_decompressors,
+    decompress,
+    get_decompressor,
+    is_compressed,
+    register_decompressor,
+)
+
+
+def make_message(body, content_encoding):
+    return asynqp.IncomingMessage(
+        body=body,
+        content_encoding=content_encoding,
+        sender=None,
+        delivery_tag=None,
+        exchange_name=None,
+        routing_key=None,
+    )
+
+
+@pytest.mark.parametrize(('content_encoding', 'body'), [
+    ('gzip', gzip.compress(b'{"key": "value"}')),
+    ('GZIP', gzip.compress(b'{"key": "value"}')),
+    ('deflate', zlib.compress(b'{"key": "value"}')),
+    ('identity', b'{"key": "value"}'),
+])
+def test_decompress(content_encoding, body):
+    # arrange
+    message = make_message(body, content_encoding)
+
+    # act
+    result = decompress(message)
+
+    # assert
+    assert is_compressed(message)
+    assert result == b'{"key": "value"}'
+
+
+@pytest.mark.parametrize('content_encoding', ['utf-8', 'ascii'])
+def test_is_compressed__when_content_encoding_is_not_compression(content_encoding):
+    # arrange
+    message = make_message(b'{}', content_encoding)
+
+    # act & assert
+    assert not is_compressed(message)
+
+
+def test_decompress__when_body_is_corrupted():
+    # arrange
+    message = make_message(b'not gzip', 'gzip')
+
+    # act & assert
+    with pytest.raises(DecompressionError):
+        decompress(message)
+
+
+def test_register_decompressor(mocker):
+    # arrange
+    mocker.patch.dict('asynqp_consumer.compression._decompressors')
+
+    # act
+    register_decompressor('X-Reversed', lambda body: body[::-1])
+
+    # assert
+    assert get_decompressor('x-reversed')(b'}{') == b'{}'
+
+
+@pytest.mark.parametrize(('content_encoding', 'package'), [('zstd', 'zstandard'), ('lz4', 'lz4')])
+def test_register_optional_decompressors__when_package_is_not_installed(mocker, content_encoding, package):
+    # arrange
+    mocker.patch.dict('asynqp_consumer.compression._decompressors')
+    mocker.patch.dict(sys.modules, {'zstandard': None, 'lz4': None, 'lz4.frame': None})
+    message = make_message(b'compressed', content_encoding)
+
+    # act
+    _register_optional_decompressors()
+
+    # assert
+    assert is_compressed(message)
+    with pytest.raises(DecompressionError, match='{} is not installed'.format(package)):
+        decompress(message)
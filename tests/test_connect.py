@@ -3,7 +3,7 @@ import pytest
 from tests.utils import future
 
 from asynqp_consumer import ConnectionParams
-from asynqp_consumer.connect import connect_and_open_channel
+from asynqp_consumer.connect import connect, connect_and_open_channel
 
 
 @pytest.mark.asyncio
@@ -33,3 +33,30 @@ async def test_connect_and_open_channel(mocker, event_loop):
         virtual_host='/',
         loop=event_loop,
     )
+
+
+@pytest.mark.asyncio
+async def test_connect(mocker, event_loop):
+    # arrange
+    connection = mocker.Mock(spec=asynqp.Connection)
+
+    asynqp_connect = mocker.patch(
+        'asynqp_consumer.connect.asynqp.connect',
+        autospec=True,
+        return_value=future(connection)
+    )
+
+    # act
+    result = await connect(ConnectionParams(), event_loop)
+
+    # assert
+    assert result is connection
+
+    asynqp_connect.assert_called_once_with(
+        host='localhost',
+        port=5672,
+        username='guest',
+        password='guest',
+        virtual_host='/',
+        loop=event_loop,
+    )
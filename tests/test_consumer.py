@@ -1,13 +1,28 @@
 import asyncio
+import gzip
 import json
+import sys
 from asyncio import Future
 from unittest import mock
 
 import asynqp
 import pytest
 
-from asynqp_consumer import ConnectionParams, Consumer, Exchange, Queue, QueueBinding, Message
+from asynqp_consumer import (
+    ConnectionManager,
+    ConnectionParams,
+    Consumer,
+    Exchange,
+    Message,
+    Queue,
+    QueueBinding,
+    QueueStats,
+    Spool,
+    TokenBucket,
+)
+from asynqp_consumer.compression import _register_optional_decompressors
 from asynqp_consumer.consumer import ConsumerCloseException
+from asynqp_consumer.message import NoAckMessage
 
 from tests.utils import future
 
@@ -63,21 +78,58 @@ async def test_start__two_attempts(mocker, event_loop):
     sleep = mocker.patch('asynqp_consumer.consumer.asyncio.sleep', return_value=future())
 
     # act
-    await consumer.start(loop=event_loop)
+    await consumer.start()
 
     # assert
     assert consumer._connect.mock_calls == [
-        mocker.call(loop=event_loop),
-        mocker.call(loop=event_loop),
+        mocker.call(),
+        mocker.call(),
     ]
     consumer._disconnect.assert_called_once_with()
-    consumer._process_queue.assert_called_once_with(loop=event_loop)
-    consumer._check_bulk.assert_called_once_with(loop=event_loop)
-    sleep.assert_called_once_with(3, loop=event_loop)
+    consumer._process_queue.assert_called_once_with()
+    consumer._check_bulk.assert_called_once_with()
+    sleep.assert_called_once_with(3)
 
 
 @pytest.mark.asyncio
-async def test__connect__ok(mocker, event_loop):
+async def test_start__cancelling_one_consumer_keeps_shared_connection(mocker):
+    # arrange
+    connection = mocker.Mock(spec=asynqp.Connection)
+    connection.closed = asyncio.Future()
+    connection_manager = mocker.Mock(spec=ConnectionManager)
+
+    def get_shared_consumer():
+        consumer = get_consumer(callback=simple_callback, connection_manager=connection_manager)
+
+        async def connect():
+            consumer._connection = connection
+
+        mocker.patch.object(consumer, '_connect', side_effect=connect)
+        mocker.patch.object(consumer, '_disconnect', return_value=future())
+        mocker.patch.object(consumer, '_process_queue', side_effect=lambda: asyncio.Future())
+        mocker.patch.object(consumer, '_check_bulk', side_effect=lambda: asyncio.Future())
+        return consumer
+
+    first, second = get_shared_consumer(), get_shared_consumer()
+    first_task = asyncio.ensure_future(first.start())
+    second_task = asyncio.ensure_future(second.start())
+    await asyncio.sleep(0)
+
+    # act
+    first_task.cancel()
+    await asyncio.sleep(0.01)
+
+    # assert
+    assert first_task.cancelled()
+    assert not connection.closed.done()
+    assert not second_task.done()
+
+    second.close()
+    await asyncio.wait_for(second_task, 1)
+
+
+@pytest.mark.asyncio
+async def test__connect__ok(mocker):
     # arrange
     connection = mocker.Mock(spec=asynqp.Connection)
 
@@ -95,7 +147,7 @@ async def test__connect__ok(mocker, event_loop):
     consumer = get_consumer(callback=simple_callback)
 
     # act
-    await consumer._connect(loop=event_loop)
+    await consumer._connect()
 
     # assert
     connect_and_open_channel.assert_called_once_with(ConnectionParams(
@@ -104,7 +156,7 @@ async def test__connect__ok(mocker, event_loop):
         username='test_username',
         password='test_password',
         virtual_host='test_virtual_host',
-    ), event_loop)
+    ))
 
     declare_queue.assert_called_once_with(channel, Queue(
         name='test_queue',
@@ -121,6 +173,104 @@ async def test__connect__ok(mocker, event_loop):
     assert consumer._connection is connection
     assert consumer._channel is channel
     assert consumer._queue is asynqp_queue
+    assert consumer._channels == [channel]
+    assert consumer._queues == [asynqp_queue]
+
+
+@pytest.mark.asyncio
+async def test__connect__with_several_channels(mocker):
+    # arrange
+    connection = mocker.Mock(spec=asynqp.Connection)
+    channels = [mocker.Mock(spec=asynqp.Channel) for _ in range(3)]
+    queues = [mocker.Mock(spec=asynqp.Queue) for _ in range(3)]
+    queues[0].name = 'test_queue'
+    for channel, queue in zip(channels, queues):
+        channel.set_qos.return_value = future()
+        channel.declare_queue.return_value = future(queue)
+    connection.open_channel.side_effect = iter([future(channels[1]), future(channels[2])])
+
+    mocker.patch(
+        'asynqp_consumer.consumer.connect_and_open_channel',
+        autospec=True,
+        return_value=future((connection, channels[0])),
+    )
+    mocker.patch('asynqp_consumer.consumer.declare_queue', autospec=True, return_value=future(queues[0]))
+
+    consumer = get_consumer(callback=simple_callback, prefetch_count=10, channels=3)
+
+    # act
+    await consumer._connect()
+
+    # assert
+    assert consumer._channels == channels
+    assert consumer._queues == queues
+    for channel in channels:
+        channel.set_qos.assert_called_once_with(prefetch_count=10)
+    for channel in channels[1:]:
+        channel.declare_queue.assert_called_once_with('test_queue', passive=True)
+
+
+@pytest.mark.asyncio
+async def test__connect__with_connection_manager(mocker):
+    # arrange
+    connection = mocker.Mock(spec=asynqp.Connection)
+    channel = mocker.Mock(spec=asynqp.Channel)
+    channel.set_qos.return_value = future()
+
+    connection_manager = mocker.Mock(spec=ConnectionManager)
+    connection_manager.open_channel.return_value = future((connection, channel))
+
+    connect_and_open_channel = mocker.patch('asynqp_consumer.consumer.connect_and_open_channel', autospec=True)
+    mocker.patch('asynqp_consumer.consumer.declare_queue', autospec=True, return_value=future())
+
+    consumer = get_consumer(callback=simple_callback, connection_manager=connection_manager)
+
+    # act
+    await consumer._connect()
+
+    # assert
+    assert not connect_and_open_channel.called
+    assert consumer._connection is connection
+    assert consumer._channels == [channel]
+
+
+@pytest.mark.asyncio
+async def test__disconnect__with_connection_manager_keeps_connection(mocker):
+    # arrange
+    consumer = get_consumer(callback=simple_callback, connection_manager=mocker.Mock(spec=ConnectionManager))
+    consumer._connection = mocker.Mock(spec=asynqp.Connection)
+    channel = mocker.Mock(spec=asynqp.Channel)
+    channel.close.return_value = future()
+    consumer._channels = [channel]
+
+    # act
+    await consumer._disconnect()
+
+    # assert
+    channel.close.assert_called_once_with()
+    assert not consumer._connection.close.called
+
+
+@pytest.mark.asyncio
+async def test__disconnect__closes_monitor_channel(mocker):
+    # arrange
+    consumer = get_consumer(callback=simple_callback, connection_manager=mocker.Mock(spec=ConnectionManager))
+    consumer._connection = mocker.Mock(spec=asynqp.Connection)
+    channel = mocker.Mock(spec=asynqp.Channel)
+    channel.close.return_value = future()
+    consumer._channels = [channel]
+    monitor_channel = mocker.Mock(spec=asynqp.Channel)
+    monitor_channel.close.return_value = future()
+    consumer._monitor_channel = monitor_channel
+
+    # act
+    await consumer._disconnect()
+
+    # assert
+    monitor_channel.close.assert_called_once_with()
+    channel.close.assert_called_once_with()
+    assert consumer._monitor_channel is None
+    assert not consumer._connection.close.called
 
 
 @pytest.mark.asyncio
@@ -131,15 +281,16 @@ async def test__disconnect_ok(mocker):
     connection = mocker.patch.object(consumer, '_connection', autospec=True)
     connection.close.return_value = future()
 
-    channel = mocker.patch.object(consumer, '_channel', autospec=True)
+    channel = mocker.Mock(spec=asynqp.Channel)
     channel.close.return_value = future()
+    consumer._channels = [channel]
 
     # act
     await consumer._disconnect()
 
     # assert
     consumer._connection.close.assert_called_once_with()
-    consumer._channel.close.assert_called_once_with()
+    channel.close.assert_called_once_with()
 
 
 def test_close(mocker):
@@ -174,17 +325,17 @@ class AsyncIter:
 
 
 @pytest.mark.asyncio
-async def test__process_queue__when_prefetch_count_is_0(mocker, event_loop):
+async def test__process_queue__when_prefetch_count_is_0(mocker):
     # arrange
     consumer = get_consumer(callback=simple_callback, prefetch_count=0)
     mocker.patch.object(consumer, '_get_messages_iterator', return_value=future(AsyncIter([
-        mock.Mock(spec=asynqp.IncomingMessage),
-        mock.Mock(spec=asynqp.IncomingMessage),
+        mock.Mock(spec=asynqp.IncomingMessage, content_encoding=None),
+        mock.Mock(spec=asynqp.IncomingMessage, content_encoding=None),
     ])))
     mocker.patch.object(consumer, '_process_bulk', return_value=future())
 
     # act
-    await consumer._process_queue(loop=event_loop)
+    await consumer._process_queue()
 
     # assert
     assert len(consumer._messages) == 2
@@ -194,17 +345,17 @@ async def test__process_queue__when_prefetch_count_is_0(mocker, event_loop):
 
 
 @pytest.mark.asyncio
-async def test__process_queue__when_prefetch_count_is_not_0(mocker, event_loop):
+async def test__process_queue__when_prefetch_count_is_not_0(mocker):
     # arrange
     consumer = get_consumer(callback=simple_callback, prefetch_count=1)
     mocker.patch.object(consumer, '_get_messages_iterator', return_value=future(AsyncIter([
-        mock.Mock(spec=asynqp.IncomingMessage),
-        mock.Mock(spec=asynqp.IncomingMessage),
+        mock.Mock(spec=asynqp.IncomingMessage, content_encoding=None),
+        mock.Mock(spec=asynqp.IncomingMessage, content_encoding=None),
     ])))
     mocker.patch.object(consumer, '_process_bulk', side_effect=iter([future(), future()]))
 
     # act
-    await consumer._process_queue(loop=event_loop)
+    await consumer._process_queue()
 
     # assert
     assert len(consumer._messages) == 2
@@ -214,25 +365,25 @@ async def test__process_queue__when_prefetch_count_is_not_0(mocker, event_loop):
 
 
 @pytest.mark.asyncio
-async def test__process_queue__when_message_is_invalid_json(mocker, event_loop):
+async def test__process_queue__when_message_is_invalid_json(mocker):
     # arrange
     consumer = get_consumer(callback=simple_callback, prefetch_count=1)
 
-    message = mock.Mock(spec=asynqp.IncomingMessage)
+    message = mock.Mock(spec=asynqp.IncomingMessage, content_encoding=None)
     message.json.side_effect = json.JSONDecodeError('message', '', 0)
     message.body = 'Error json'
 
     mocker.patch.object(consumer, '_get_messages_iterator', return_value=future(AsyncIter([message])))
 
     # act
-    await consumer._process_queue(loop=event_loop)
+    await consumer._process_queue()
 
     # assert
     assert consumer._messages == []
 
 
 @pytest.mark.asyncio
-async def test__process_queue__ack_message_when_json_is_invalid(mocker, event_loop, capsys):
+async def test__process_queue__ack_message_when_json_is_invalid(mocker, capsys):
     # arrange
     consumer = get_consumer(callback=simple_callback, prefetch_count=1, reject_invalid_json=False)
 
@@ -248,7 +399,7 @@ async def test__process_queue__ack_message_when_json_is_invalid(mocker, event_lo
     logger_exception = mocker.patch('asynqp_consumer.consumer.logger.exception')
 
     # act
-    await consumer._process_queue(loop=event_loop)
+    await consumer._process_queue()
 
     # assert
     assert consumer._messages == []
@@ -256,30 +407,113 @@ async def test__process_queue__ack_message_when_json_is_invalid(mocker, event_lo
     logger_exception.assert_called_once_with('Failed to parse message body: %s', b'Invalid JSON')
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize(('body', 'content_encoding'), [
+    (b'Not gzip', 'gzip'),
+    (b'zstd frame', 'zstd'),
+    (gzip.compress(b'{"key": "\xff"}'), 'gzip'),
+    (b'{"key": "\xff"}', 'utf-8'),
+    (b'{"key": "value"}', 'x-unknown'),
+])
+async def test__process_queue__reject_message_when_body_cannot_be_decoded(mocker, body, content_encoding):
+    # arrange
+    consumer = get_consumer(callback=simple_callback, prefetch_count=1)
+    mocker.patch.dict('asynqp_consumer.compression._decompressors')
+    mocker.patch.dict(sys.modules, {'zstandard': None, 'lz4': None, 'lz4.frame': None})
+    _register_optional_decompressors()
+
+    message = asynqp.IncomingMessage(
+        body=body,
+        content_encoding=content_encoding,
+        sender=None,
+        delivery_tag=None,
+        exchange_name=None,
+        routing_key=None,
+    )
+    mocker.patch.object(message, 'reject', autospec=True)
+    mocker.patch.object(consumer, '_get_messages_iterator', return_value=future(AsyncIter([message])))
+
+    # act
+    await consumer._process_queue()
+
+    # assert
+    assert consumer._messages == []
+    message.reject.assert_called_once_with(requeue=True)
+
+
+@pytest.mark.asyncio
+async def test__process_queue__with_identity_content_encoding(mocker):
+    # arrange
+    consumer = get_consumer(callback=simple_callback, prefetch_count=2)
+    mocker.patch.object(consumer, '_process_bulk', return_value=future())
+
+    message = asynqp.IncomingMessage(
+        body=b'{"key": "value"}',
+        content_encoding='identity',
+        sender=None,
+        delivery_tag=None,
+        exchange_name=None,
+        routing_key=None,
+    )
+    mocker.patch.object(message, 'reject', autospec=True)
+    mocker.patch.object(consumer, '_get_messages_iterator', return_value=future(AsyncIter([message])))
+
+    # act
+    await consumer._process_queue()
+
+    # assert
+    assert [m.body for m in consumer._messages] == [{'key': 'value'}]
+    assert not message.reject.called
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(('threshold', 'in_executor'), [(None, False), (10, True), (1000, False)])
+async def test__create_message__decompress_in_executor(mocker, threshold, in_executor):
+    # arrange
+    consumer = get_consumer(callback=simple_callback, decompress_in_executor_threshold=threshold)
+
+    message = asynqp.IncomingMessage(
+        body=gzip.compress(b'{"key": "value"}'),
+        content_encoding='gzip',
+        sender=None,
+        delivery_tag=None,
+        exchange_name=None,
+        routing_key=None,
+    )
+    run_in_executor = mocker.spy(asyncio.get_event_loop(), 'run_in_executor')
+
+    # act
+    result = await consumer._create_message(message)
+
+    # assert
+    assert result.body == {'key': 'value'}
+    assert run_in_executor.called is in_executor
+
+
 class SomeException(Exception):
     pass
 
 
 @pytest.mark.asyncio
-async def test__iter_messages(mocker, event_loop):
+async def test__iter_messages(mocker):
     # arrange
     queue = mocker.Mock(spec=asynqp.Queue)
     queue.consume.return_value = future()
 
     consumer = get_consumer(callback=simple_callback, prefetch_count=0)
-    mocker.patch.object(consumer, '_queue', new=queue)
+    mocker.patch.object(consumer, '_queues', new=[queue])
 
     queue = mocker.patch('asynqp_consumer.consumer.asyncio.Queue').return_value
     queue.get.side_effect = iter([
-        future(Message(mock.Mock(spec=asynqp.IncomingMessage))),
-        future(Message(mock.Mock(spec=asynqp.IncomingMessage))),
+        future(Message(mock.Mock(spec=asynqp.IncomingMessage, content_encoding=None))),
+        future(Message(mock.Mock(spec=asynqp.IncomingMessage, content_encoding=None))),
         future(exception=SomeException),
     ])
 
     # act
     result = []
     with pytest.raises(SomeException):
-        messages_iterator = await consumer._get_messages_iterator(loop=event_loop)
+        messages_iterator = await consumer._get_messages_iterator()
         async for message in messages_iterator:
             result.append(message)
 
@@ -290,18 +524,492 @@ async def test__iter_messages(mocker, event_loop):
 
 
 @pytest.mark.asyncio
-async def test__consume_with_arguments(mocker, event_loop):
+async def test__consume_with_arguments(mocker):
     # arrange
     queue = mocker.Mock(spec=asynqp.Queue)
     queue.consume.return_value = future()
 
     consume_arguments = {'x-priority': 100}
     consumer = get_consumer(callback=simple_callback, prefetch_count=0, consume_arguments=consume_arguments)
-    mocker.patch.object(consumer, '_queue', new=queue)
+    mocker.patch.object(consumer, '_queues', new=[queue])
     asyncio_queue = mocker.patch('asynqp_consumer.consumer.asyncio.Queue').return_value
 
     # act
-    await consumer._get_messages_iterator(loop=event_loop)
+    await consumer._get_messages_iterator()
+
+    # assert
+    queue.consume.assert_called_once_with(
+        callback=asyncio_queue.put_nowait,
+        no_ack=False,
+        arguments=consume_arguments,
+    )
+
+
+@pytest.mark.asyncio
+async def test__get_messages_iterator__consumes_on_every_channel(mocker):
+    # arrange
+    queues = [mocker.Mock(spec=asynqp.Queue), mocker.Mock(spec=asynqp.Queue)]
+    for queue in queues:
+        queue.consume.return_value = future()
+
+    consumer = get_consumer(callback=simple_callback, channels=2)
+    consumer._queues = queues
+    asyncio_queue = mocker.patch('asynqp_consumer.consumer.asyncio.Queue').return_value
+
+    # act
+    await consumer._get_messages_iterator()
+
+    # assert
+    for queue in queues:
+        queue.consume.assert_called_once_with(callback=asyncio_queue.put_nowait, no_ack=False, arguments=None)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(('prefetch_count', 'stats', 'expected'), [
+    (10, QueueStats(message_count=1000, consumer_count=1), 20),
+    (10, QueueStats(message_count=1000, consumer_count=1, drain_rate=-5.0), 20),
+    (40, QueueStats(message_count=1000, consumer_count=1, drain_rate=0.0), 50),
+    (20, QueueStats(message_count=1000, consumer_count=1, drain_rate=100.0, eta=10.0), 20),
+    (40, QueueStats(message_count=0, consumer_count=1, drain_rate=10.0, eta=0.0), 20),
+    (15, QueueStats(message_count=0, consumer_count=1, drain_rate=10.0, eta=0.0), 10),
+])
+async def test__scale_prefetch_count(mocker, prefetch_count, stats, expected):
+    # arrange
+    consumer = get_consumer(callback=simple_callback, prefetch_count=10, max_prefetch_count=50, monitor_interval=1)
+    consumer._prefetch_count = prefetch_count
+    channels = [mocker.Mock(spec=asynqp.Channel), mocker.Mock(spec=asynqp.Channel)]
+    for channel in channels:
+        channel.set_qos.side_effect = lambda prefetch_count: future()
+    consumer._channels = channels
+
+    # act
+    await consumer._scale_prefetch_count(stats)
+
+    # assert
+    assert consumer._prefetch_count == expected
+    for channel in channels:
+        if expected == prefetch_count:
+            assert not channel.set_qos.called
+        else:
+            channel.set_qos.assert_called_once_with(prefetch_count=expected)
+
+
+@pytest.mark.asyncio
+async def test__monitor_queue(mocker):
+    # arrange
+    stats = QueueStats(message_count=1000, consumer_count=1)
+    on_queue_stats = mocker.Mock(side_effect=iter([future(exception=SomeException), future()]))
+    consumer = get_consumer(callback=simple_callback, monitor_interval=5, on_queue_stats=on_queue_stats)
+
+    connection = mocker.patch.object(consumer, '_connection', autospec=True)
+    connection.open_channel.return_value = future(mocker.sentinel.channel)
+    mocker.patch.object(consumer, '_queue', autospec=True).name = 'test_queue'
+    mocker.patch.object(consumer, '_scale_prefetch_count')
+
+    QueueMonitor = mocker.patch('asynqp_consumer.consumer.QueueMonitor', autospec=True)
+    QueueMonitor.return_value.get_stats.side_effect = iter([
+        future(stats),
+        future(stats),
+        future(exception=SomeException),
+    ])
+
+    sleep = mocker.patch('asynqp_consumer.consumer.asyncio.sleep', return_value=future())
+
+    # act
+    with pytest.raises(SomeException):
+        await consumer._monitor_queue()
+
+    # assert
+    QueueMonitor.assert_called_once_with(mocker.sentinel.channel, 'test_queue')
+    assert consumer._monitor_channel is mocker.sentinel.channel
+    assert on_queue_stats.mock_calls == [mocker.call(stats), mocker.call(stats)]
+    assert sleep.mock_calls == [mocker.call(5)] * 3
+    assert not consumer._scale_prefetch_count.called
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(('reject_invalid_json', 'rejected', 'acked'), [
+    (True, [1, 2], [0, 3]),
+    (False, [], [0, 1, 2, 3]),
+])
+async def test__process_bulk__with_columns(mocker, reject_invalid_json, rejected, acked):
+    # arrange
+    batches = []
+
+    async def callback(batch):
+        batches.append(batch)
+
+    consumer = get_consumer(callback=callback, columns={'id': 'q'}, reject_invalid_json=reject_invalid_json)
+    consumer._messages_lock = asyncio.Lock()
+
+    incoming_messages = [
+        make_incoming_message(body) for body in [b'{"id": 1}', b'{}', b'Invalid JSON', b'{"id": 2}']
+    ]
+    consumer._messages = [await consumer._create_message(m) for m in incoming_messages]
+
+    # act
+    await consumer._process_bulk(force=True)
+
+    # assert
+    assert len(batches) == 1
+    assert list(batches[0]['id']) == [1, 2]
+    assert [m._message for m in batches[0].messages] == [incoming_messages[0], incoming_messages[3]]
+    assert [i for i, m in enumerate(incoming_messages) if m.reject.called] == rejected
+    assert [i for i, m in enumerate(incoming_messages) if m.ack.called] == acked
+
+
+@pytest.mark.asyncio
+async def test__create_message__with_columns_defers_decoding(mocker):
+    # arrange
+    consumer = get_consumer(callback=simple_callback, columns={'id': 'q'})
+    incoming_message = make_incoming_message(b'Invalid JSON')
+    json_loads = mocker.spy(json, 'loads')
+
+    # act
+    message = await consumer._create_message(incoming_message)
+
+    # assert
+    assert isinstance(message, Message)
+    assert not json_loads.called
+
+
+def test_init__with_invalid_columns_typecode():
+    # act & assert
+    with pytest.raises(ValueError, match="column 'id'"):
+        get_consumer(callback=simple_callback, columns={'id': 'Z'})
+
+
+def make_priority_message(priority):
+    incoming_message = mock.Mock(spec=asynqp.IncomingMessage, content_encoding=None, priority=priority)
+    incoming_message.json.return_value = {'priority': priority}
+    return incoming_message
+
+
+@pytest.mark.asyncio
+async def test__process_queue__urgent_message_is_processed_immediately(mocker):
+    # arrange
+    consumer = get_consumer(callback=simple_callback, prefetch_count=10, urgent_priority=5)
+    incoming_messages = [make_priority_message(priority) for priority in [None, 5, 1, 9]]
+    mocker.patch.object(consumer, '_get_messages_iterator', return_value=future(AsyncIter(incoming_messages)))
+    mocker.patch.object(consumer, '_process_bulk', side_effect=lambda: future())
+    mocker.patch.object(consumer, '_process_messages', side_effect=lambda messages: future())
+
+    # act
+    await consumer._process_queue()
+
+    # assert
+    assert [m.body['priority'] for m in consumer._messages] == [None, 1]
+    assert [call[1][0][0].body['priority'] for call in consumer._process_messages.mock_calls] == [5, 9]
+
+
+def test_init__messages_rate_limit_without_prefetch_count():
+    # act & assert
+    with pytest.raises(AssertionError):
+        get_consumer(callback=simple_callback, messages_rate_limit=TokenBucket(rate=10))
+
+
+@pytest.mark.asyncio
+async def test__get_messages_iterator__with_messages_rate_limit(mocker, event_loop):
+    # arrange
+    acquired = asyncio.Future(loop=event_loop)
+    rate_limit = mocker.Mock(spec=TokenBucket)
+    rate_limit.acquire.side_effect = [acquired, future()]
+    queue = mocker.Mock(spec=asynqp.Queue)
+    queue.consume.return_value = future(mocker.Mock(spec=asynqp.queue.Consumer))
+    consumer = get_consumer(callback=simple_callback, prefetch_count=10, messages_rate_limit=rate_limit)
+    consumer._queues = [queue]
+
+    # act
+    iterator = await consumer._get_messages_iterator()
+    deliver = queue.consume.call_args[1]['callback']
+    deliver(make_incoming_message(b'0'))
+    deliver(make_incoming_message(b'1'))
+    next_message = asyncio.ensure_future(iterator.__anext__())
+    await asyncio.sleep(0)
+
+    # assert
+    assert not next_message.done()
+    assert iterator._queue.qsize() == 2
+
+    acquired.set_result(None)
+    assert (await next_message).body == b'0'
+    assert (await iterator.__anext__()).body == b'1'
+    assert rate_limit.acquire.mock_calls == [mocker.call(), mocker.call()]
+
+
+@pytest.mark.asyncio
+async def test__process_messages__with_batches_rate_limit(mocker):
+    # arrange
+    rate_limit = mocker.Mock(spec=TokenBucket)
+    rate_limit.acquire.side_effect = lambda: future()
+    callback = mocker.Mock(side_effect=lambda messages: future())
+    consumer = get_consumer(callback=callback, batches_rate_limit=rate_limit)
+    message = mocker.Mock(spec=Message)
+
+    # act
+    await consumer._process_messages([message])
+
+    # assert
+    rate_limit.acquire.assert_called_once_with()
+    callback.assert_called_once_with([message])
+    message.ack.assert_called_once_with()
+
+
+def make_incoming_message(body):
+    message = asynqp.IncomingMessage(
+        body=body,
+        sender=None,
+        delivery_tag=None,
+        exchange_name=None,
+        routing_key=None,
+    )
+    message.ack = mock.Mock()
+    message.reject = mock.Mock()
+    return message
+
+
+@pytest.mark.asyncio
+async def test__process_messages__with_spool_acks_after_append(tmp_path):
+    # arrange
+    spool = Spool(str(tmp_path))
+    callback = mock.Mock()
+    consumer = get_consumer(callback=callback, spool=spool)
+    consumer._spool_lock = asyncio.Lock()
+    consumer._spool_appended = asyncio.Event()
+    incoming_messages = [make_incoming_message(b'{"id": 1}'), make_incoming_message(b'{"id": 2}')]
+
+    # act
+    await consumer._process_messages([Message(m) for m in incoming_messages])
+
+    # assert
+    assert not callback.called
+    assert [r.body for r in spool.read(10)] == [b'{"id": 1}', b'{"id": 2}']
+    for incoming_message in incoming_messages:
+        incoming_message.ack.assert_called_once_with()
+    assert consumer._spool_appended.is_set()
+
+
+@pytest.mark.asyncio
+async def test__process_messages__with_spool_rejects_when_append_fails(mocker):
+    # arrange
+    spool = mocker.Mock(spec=Spool)
+    spool.append.side_effect = OSError
+    consumer = get_consumer(callback=simple_callback, spool=spool)
+    consumer._spool_lock = asyncio.Lock()
+    consumer._spool_appended = asyncio.Event()
+    incoming_message = make_incoming_message(b'{"id": 1}')
+
+    # act
+    await consumer._process_messages([Message(incoming_message)])
+
+    # assert
+    incoming_message.reject.assert_called_once_with(requeue=True)
+    assert not incoming_message.ack.called
+    assert not consumer._spool_appended.is_set()
+
+
+@pytest.mark.asyncio
+async def test__process_spool(tmp_path, mocker):
+    # arrange
+    spool = Spool(str(tmp_path))
+    spool.append([(b'{"id": 1}', None), (b'{"id": 2}', None), (b'{"id": 3}', None)])
+    batches = []
+    done = asyncio.Event()
+
+    async def callback(messages):
+        batches.append([m.body['id'] for m in messages])
+        if len(batches) == 1:
+            raise SomeException
+        if len(batches) == 3:
+            done.set()
+
+    consumer = get_consumer(callback=callback, spool=spool, prefetch_count=2)
+    consumer._spool_appended = asyncio.Event()
+    mocker.patch.object(consumer, 'RECONNECT_TIMEOUT', 0)
+
+    # act
+    task = asyncio.ensure_future(consumer._process_spool())
+    await asyncio.wait_for(done.wait(), 1)
+    await asyncio.sleep(0.01)
+    task.cancel()
+
+    # assert
+    assert batches == [[1, 2], [1, 2], [3]]
+    spool.rewind()
+    assert spool.read(10) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('fail_in', ['read', 'commit'])
+async def test_start__closes_when_spool_reader_fails(tmp_path, mocker, fail_in):
+    # arrange
+    spool = Spool(str(tmp_path))
+    spool.append([(b'{"id": 1}', None)])
+    mocker.patch.object(spool, fail_in, side_effect=OSError('Disk failure'))
+    consumer = get_consumer(callback=simple_callback, spool=spool)
+
+    async def connect():
+        consumer._connection = mocker.Mock(spec=asynqp.Connection)
+        consumer._connection.closed = asyncio.Future()
+
+    mocker.patch.object(consumer, '_connect', side_effect=connect)
+    mocker.patch.object(consumer, '_disconnect', return_value=future())
+    mocker.patch.object(consumer, '_process_queue', return_value=future())
+    mocker.patch.object(consumer, '_check_bulk', side_effect=lambda: asyncio.Future())
+
+    # act
+    with pytest.raises(OSError, match='Disk failure'):
+        await asyncio.wait_for(consumer.start(), 1)
+
+    # assert
+    consumer._disconnect.assert_called_once_with()
+    assert consumer._closed is None
+
+
+@pytest.mark.asyncio
+async def test__process_queue__with_ack_mode_none(mocker):
+    # arrange
+    consumer = get_consumer(callback=simple_callback, ack_mode='none')
+    valid_message = make_incoming_message(b'{"id": 1}')
+    invalid_message = make_incoming_message(b'Invalid JSON')
+    mocker.patch.object(consumer, '_get_messages_iterator', return_value=future(AsyncIter([
+        valid_message,
+        invalid_message,
+    ])))
+
+    # act
+    await consumer._process_queue()
+
+    # assert
+    assert len(consumer._messages) == 1
+    assert isinstance(consumer._messages[0], NoAckMessage)
+    assert not invalid_message.ack.called
+    assert not invalid_message.reject.called
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('fail', [False, True])
+async def test__process_messages__with_ack_mode_none_skips_settlement(mocker, fail):
+    # arrange
+    callback = mocker.Mock(return_value=future(exception=SomeException if fail else None))
+    consumer = get_consumer(callback=callback, ack_mode='none')
+    message = mocker.Mock(spec=Message)
+
+    # act
+    await consumer._process_messages([message])
+
+    # assert
+    callback.assert_called_once_with([message])
+    assert not message.ack.called
+    assert not message.reject.called
+
+
+@pytest.mark.asyncio
+async def test__get_messages_iterator__with_ack_mode_none_pauses_when_buffer_is_full(mocker):
+    # arrange
+    mq_consumers = [mocker.Mock(spec=asynqp.queue.Consumer), mocker.Mock(spec=asynqp.queue.Consumer)]
+    for mq_consumer in mq_consumers:
+        mq_consumer.cancel.return_value = future()
+    queue = mocker.Mock(spec=asynqp.Queue)
+    queue.consume.side_effect = [future(mq_consumer) for mq_consumer in mq_consumers]
+    consumer = get_consumer(callback=simple_callback, ack_mode='none', no_ack_buffer_size=2)
+    consumer._queues = [queue]
+
+    # act
+    iterator = await consumer._get_messages_iterator()
+    deliver = queue.consume.call_args[1]['callback']
+    for i in range(4):
+        deliver(make_incoming_message(str(i).encode()))
+    await asyncio.sleep(0)
+
+    # assert
+    assert queue.consume.call_args[1]['no_ack'] is True
+    assert iterator.paused
+    mq_consumers[0].cancel.assert_called_once_with()
+    assert queue.consume.call_count == 1
+
+    assert [(await iterator.__anext__()).body for _ in range(3)] == [b'0', b'1', b'2']
+    assert not iterator.paused
+    assert queue.consume.call_count == 2
+    assert not mq_consumers[1].cancel.called
+    assert (await iterator.__anext__()).body == b'3'
+    assert consumer.dropped == 0
+
+
+@pytest.mark.asyncio
+async def test__get_messages_iterator__with_ack_mode_none_pauses_again_while_resuming(mocker):
+    # arrange
+    mq_consumers = [mocker.Mock(spec=asynqp.queue.Consumer), mocker.Mock(spec=asynqp.queue.Consumer)]
+    for mq_consumer in mq_consumers:
+        mq_consumer.cancel.return_value = future()
+
+    def consume(callback, **kwargs):
+        if queue.consume.call_count == 2:
+            callback(make_incoming_message(b'a'))
+            callback(make_incoming_message(b'b'))
+        return future(mq_consumers[queue.consume.call_count - 1])
+
+    queue = mocker.Mock(spec=asynqp.Queue)
+    queue.consume.side_effect = consume
+    consumer = get_consumer(callback=simple_callback, ack_mode='none', no_ack_buffer_size=2)
+    consumer._queues = [queue]
+
+    # act
+    iterator = await consumer._get_messages_iterator()
+    deliver = queue.consume.call_args[1]['callback']
+    for i in range(3):
+        deliver(make_incoming_message(str(i).encode()))
+    await asyncio.sleep(0)
+    bodies = [(await iterator.__anext__()).body for _ in range(3)]
+    await asyncio.sleep(0)
+
+    # assert
+    assert bodies == [b'0', b'1', b'2']
+    assert queue.consume.call_count == 2
+    assert iterator.paused
+    mq_consumers[1].cancel.assert_called_once_with()
+
+
+@pytest.mark.asyncio
+async def test__disconnect__cancels_pending_pause(mocker, event_loop):
+    # arrange
+    mq_consumer = mocker.Mock(spec=asynqp.queue.Consumer)
+    mq_consumer.cancel.return_value = asyncio.Future(loop=event_loop)
+    queue = mocker.Mock(spec=asynqp.Queue)
+    queue.consume.return_value = future(mq_consumer)
+    consumer = get_consumer(callback=simple_callback, ack_mode='none', no_ack_buffer_size=1)
+    consumer._queues = [queue]
+    iterator = await consumer._get_messages_iterator()
+    deliver = queue.consume.call_args[1]['callback']
+    deliver(make_incoming_message(b'0'))
+    deliver(make_incoming_message(b'1'))
+    await asyncio.sleep(0)
+    pausing = iterator._pausing
+
+    # act
+    await consumer._disconnect()
+
+    # assert
+    assert pausing.cancelled()
+    assert not iterator.paused
+    assert consumer._messages_iterator is None
+
+
+@pytest.mark.asyncio
+async def test__get_messages_iterator__with_drop_overflow(mocker):
+    # arrange
+    queue = mocker.Mock(spec=asynqp.Queue)
+    queue.consume.return_value = future(mocker.Mock(spec=asynqp.queue.Consumer))
+    consumer = get_consumer(callback=simple_callback, ack_mode='none', no_ack_buffer_size=2, drop_overflow=True)
+    consumer._queues = [queue]
+
+    # act
+    iterator = await consumer._get_messages_iterator()
+    deliver = queue.consume.call_args[1]['callback']
+    for i in range(3):
+        deliver(make_incoming_message(str(i).encode()))
 
     # assert
-    queue.consume.assert_called_once_with(callback=asyncio_queue.put_nowait, arguments=consume_arguments)
+    assert consumer.dropped == 1
+    assert not iterator.paused
+    assert [(await iterator.__anext__()).body for _ in range(2)] == [b'0', b'1']
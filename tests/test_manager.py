@@ -0,0 +1,130 @@
+import asyncio
+
+import asynqp
+import pytest
+
+from asynqp_consumer import ConnectionManager, ConnectionParams
+
+from tests.utils import future
+
+
+def make_connection(mocker):
+    connection = mocker.Mock(spec=asynqp.Connection)
+    connection.closed = asyncio.Future()
+    connection.closed.add_done_callback(lambda fut: fut.exception())
+    connection.is_closed.side_effect = connection.closed.done
+    connection.transport = mocker.Mock(spec=asyncio.Transport)
+    connection.transport.is_closing.return_value = False
+    connection.open_channel.side_effect = lambda: future(mocker.Mock(spec=asynqp.Channel))
+    connection.close.return_value = future()
+    return connection
+
+
+@pytest.mark.asyncio
+async def test_open_channel__round_robin_over_connections(mocker):
+    # arrange
+    connections = [make_connection(mocker), make_connection(mocker)]
+    connect = mocker.patch('asynqp_consumer.manager.connect', side_effect=[future(c) for c in connections])
+    manager = ConnectionManager(connection_params=[ConnectionParams(host='a'), ConnectionParams(host='b')], size=2)
+
+    # act
+    result = [(await manager.open_channel())[0] for _ in range(4)]
+
+    # assert
+    assert result == [connections[0], connections[1], connections[0], connections[1]]
+    assert connect.mock_calls == [mocker.call(ConnectionParams(host='a')), mocker.call(ConnectionParams(host='b'))]
+    assert connections[0].open_channel.call_count == 2
+    assert connections[1].open_channel.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_open_channel__reconnects_once_for_all_consumers(mocker):
+    # arrange
+    old_connection = make_connection(mocker)
+    new_connection = make_connection(mocker)
+    connect = mocker.patch(
+        'asynqp_consumer.manager.connect',
+        side_effect=[future(old_connection), future(new_connection)],
+    )
+    manager = ConnectionManager()
+    await manager.open_channel()
+    old_connection.closed.set_exception(asynqp.ConnectionLostError('Connection lost'))
+
+    # act
+    result = await asyncio.gather(*[manager.open_channel() for _ in range(3)])
+
+    # assert
+    assert [connection for connection, _ in result] == [new_connection] * 3
+    assert connect.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_open_channel__reconnects_when_transport_is_closing(mocker):
+    # arrange
+    old_connection = make_connection(mocker)
+    new_connection = make_connection(mocker)
+    mocker.patch('asynqp_consumer.manager.connect', side_effect=[future(old_connection), future(new_connection)])
+    manager = ConnectionManager()
+    await manager.open_channel()
+    old_connection.transport.is_closing.return_value = True
+
+    # act
+    connection, _ = await manager.open_channel()
+
+    # assert
+    assert connection is new_connection
+
+
+@pytest.mark.asyncio
+async def test_open_channel__reconnects_after_open_channel_fails(mocker):
+    # arrange
+    old_connection = make_connection(mocker)
+    old_connection.open_channel.side_effect = asynqp.ConnectionLostError('Connection lost')
+    new_connection = make_connection(mocker)
+    mocker.patch('asynqp_consumer.manager.connect', side_effect=[future(old_connection), future(new_connection)])
+    manager = ConnectionManager()
+
+    # act
+    with pytest.raises(asynqp.ConnectionLostError):
+        await manager.open_channel()
+    connection, _ = await manager.open_channel()
+
+    # assert
+    assert connection is new_connection
+
+
+@pytest.mark.asyncio
+async def test_open_channel__waiters_reuse_failed_attempt(mocker):
+    # arrange
+    connection = make_connection(mocker)
+    connect = mocker.patch(
+        'asynqp_consumer.manager.connect',
+        side_effect=[OSError('Connection refused'), future(connection)],
+    )
+    time = mocker.patch.object(asyncio.get_event_loop(), 'time', return_value=100.0)
+    manager = ConnectionManager()
+
+    # act
+    result = await asyncio.gather(*[manager.open_channel() for _ in range(3)], return_exceptions=True)
+    time.return_value += ConnectionManager.RECONNECT_TIMEOUT
+    reconnected, _ = await manager.open_channel()
+
+    # assert
+    assert all(isinstance(e, OSError) for e in result)
+    assert connect.call_count == 2
+    assert reconnected is connection
+
+
+@pytest.mark.asyncio
+async def test_close(mocker):
+    # arrange
+    connection = make_connection(mocker)
+    mocker.patch('asynqp_consumer.manager.connect', return_value=future(connection))
+    manager = ConnectionManager(size=2)
+    await manager.open_channel()
+
+    # act
+    await manager.close()
+
+    # assert
+    connection.close.assert_called_once_with()
@@ -1,14 +1,17 @@
+import gzip
+
 import asynqp
 import pytest
 
 from asynqp_consumer import Message
+from asynqp_consumer.message import NoAckMessage
 
 
 class TestMessage(object):
 
     def test_properties(self, mocker):
         # arrange
-        incoming_message = mocker.Mock(spec=asynqp.IncomingMessage)
+        incoming_message = mocker.Mock(spec=asynqp.IncomingMessage, content_encoding=None)
         incoming_message.json.return_value = {'test_key': 'test_value'}
         incoming_message.headers = object()
 
@@ -21,7 +24,7 @@ class TestMessage(object):
 
     def test_ack(self, mocker):
         # arrange
-        incoming_message = mocker.Mock(spec=asynqp.IncomingMessage)
+        incoming_message = mocker.Mock(spec=asynqp.IncomingMessage, content_encoding=None)
         incoming_message.json.return_value = {'test_key': 'test_value'}
 
         # act
@@ -37,7 +40,7 @@ class TestMessage(object):
     @pytest.mark.parametrize('requeue', (True, False))
     def test_reject(self, mocker, requeue):
         # arrange
-        incoming_message = mocker.Mock(spec=asynqp.IncomingMessage)
+        incoming_message = mocker.Mock(spec=asynqp.IncomingMessage, content_encoding=None)
         incoming_message.json.return_value = {'test_key': 'test_value'}
 
         # act
@@ -50,3 +53,49 @@ class TestMessage(object):
         # assert
         incoming_message.reject.assert_called_once_with(requeue=requeue)
         assert not incoming_message.ack.called
+
+    def test_compressed_body(self):
+        # arrange
+        incoming_message = asynqp.IncomingMessage(
+            body=gzip.compress(b'{"test_key": "test_value"}'),
+            content_encoding='gzip',
+            sender=None,
+            delivery_tag=None,
+            exchange_name=None,
+            routing_key=None,
+        )
+
+        # act
+        message = Message(incoming_message)
+
+        # assert
+        assert message.body == {'test_key': 'test_value'}
+
+    def test_decompressed_body(self, mocker):
+        # arrange
+        incoming_message = mocker.Mock(spec=asynqp.IncomingMessage, content_encoding='gzip')
+
+        # act
+        message = Message(incoming_message, b'{"test_key": "test_value"}')
+
+        # assert
+        assert message.body == {'test_key': 'test_value'}
+        assert not incoming_message.json.called
+
+
+class TestNoAckMessage:
+
+    def test_ack_and_reject_do_not_send_frames(self, mocker):
+        # arrange
+        incoming_message = mocker.Mock(spec=asynqp.IncomingMessage, content_encoding=None)
+        incoming_message.json.return_value = {'test_key': 'test_value'}
+
+        # act
+        message = NoAckMessage(incoming_message)
+        message.ack()
+        message.reject()
+
+        # assert
+        assert message.body == {'test_key': 'test_value'}
+        assert not incoming_message.ack.called
+        assert not incoming_message.reject.called
@@ -0,0 +1,61 @@
+import asynqp
+import pytest
+from asynqp import frames, spec
+
+from asynqp_consumer import Consumer, Queue, QueueStats
+from asynqp_consumer.monitor import QueueMonitor, QueueMonitorError, check_monitor_support
+
+
+class FakeChannel:
+
+    def __init__(self, counts):
+        self.counts = iter(counts)
+        self.reader = asynqp.routing.QueuedReader(
+            asynqp.channel.ChannelActor(asynqp.routing.Synchroniser(loop=None), None, loop=None),
+            loop=None,
+        )
+
+    async def declare_queue(self, name, passive):
+        assert passive
+        message_count, consumer_count = next(self.counts)
+        self.reader.handler.synchroniser.wait(spec.QueueDeclareOK)
+        self.reader.handler.handle_QueueDeclareOK(
+            frames.MethodFrame(1, spec.QueueDeclareOK(name, message_count, consumer_count))
+        )
+
+
+@pytest.mark.asyncio
+async def test_get_stats(mocker):
+    # arrange
+    channel = FakeChannel([(100, 2), (70, 2), (70, 2), (0, 1)])
+    monitor = QueueMonitor(channel, 'test_queue')
+    time = mocker.patch('asynqp_consumer.monitor.time')
+    time.monotonic.side_effect = iter([10, 20, 30, 40])
+
+    # act
+    result = [await monitor.get_stats() for _ in range(4)]
+
+    # assert
+    assert result == [
+        QueueStats(message_count=100, consumer_count=2),
+        QueueStats(message_count=70, consumer_count=2, drain_rate=3.0, eta=70 / 3),
+        QueueStats(message_count=70, consumer_count=2, drain_rate=0.0),
+        QueueStats(message_count=0, consumer_count=1, drain_rate=7.0, eta=0.0),
+    ]
+
+
+def test_queue_monitor__when_channel_has_no_reader():
+    # act & assert
+    with pytest.raises(QueueMonitorError):
+        QueueMonitor(object(), 'test_queue')
+
+
+def test_check_monitor_support__when_asynqp_internals_changed(mocker):
+    # arrange
+    mocker.patch.object(asynqp.channel, 'ChannelActor', object)
+
+    # act & assert
+    with pytest.raises(QueueMonitorError):
+        check_monitor_support()
+    with pytest.raises(QueueMonitorError):
+        Consumer(queue=Queue('test_queue'), callback=None, monitor_interval=5)
@@ -0,0 +1,69 @@
+import pytest
+
+from asynqp_consumer import TokenBucket
+
+from tests.utils import future
+
+
+@pytest.fixture
+def clock(mocker):
+    time = mocker.patch('asynqp_consumer.ratelimit.time')
+    time.monotonic.return_value = 100.0
+    return time
+
+
+@pytest.fixture
+def sleep(mocker):
+    return mocker.patch('asynqp_consumer.ratelimit.asyncio.sleep', side_effect=lambda delay: future())
+
+
+@pytest.mark.asyncio
+async def test_acquire__within_burst(clock, sleep):
+    # arrange
+    bucket = TokenBucket(rate=10, burst=3)
+
+    # act
+    for _ in range(3):
+        await bucket.acquire()
+
+    # assert
+    assert not sleep.called
+
+
+@pytest.mark.asyncio
+async def test_acquire__waits_when_bucket_is_empty(clock, sleep, mocker):
+    # arrange
+    bucket = TokenBucket(rate=10, burst=2)
+
+    # act
+    for _ in range(4):
+        await bucket.acquire()
+
+    # assert
+    assert sleep.mock_calls == [mocker.call(pytest.approx(0.1)), mocker.call(pytest.approx(0.2))]
+
+
+@pytest.mark.asyncio
+async def test_acquire__refills_over_time(clock, sleep):
+    # arrange
+    bucket = TokenBucket(rate=10, burst=2)
+    await bucket.acquire(2)
+
+    # act
+    clock.monotonic.return_value = 100.5
+    await bucket.acquire(2)
+
+    # assert
+    assert not sleep.called
+
+
+@pytest.mark.asyncio
+async def test_acquire__more_than_burst(clock, sleep, mocker):
+    # arrange
+    bucket = TokenBucket(rate=10, burst=2)
+
+    # act
+    await bucket.acquire(5)
+
+    # assert
+    sleep.assert_called_once_with(pytest.approx(0.3))
@@ -0,0 +1,156 @@
+import asyncio
+import sys
+
+import asynqp
+import pytest
+
+from asynqp_consumer import ConnectionParams, Consumer, Queue, run
+from asynqp_consumer.runner import install_uvloop
+
+
+class FakeConsumer:
+
+    def __init__(self):
+        self.started_in = None
+        self.closed = False
+
+    async def start(self):
+        self.started_in = asyncio.get_event_loop()
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def restore_policy():
+    policy = asyncio.get_event_loop_policy()
+    yield
+    asyncio.set_event_loop_policy(policy)
+
+
+def test_run__starts_consumer_on_new_loop(restore_policy):
+    # arrange
+    consumer = FakeConsumer()
+
+    # act
+    run(consumer, use_uvloop=False)
+
+    # assert
+    assert consumer.started_in is not None
+    assert consumer.started_in.is_closed()
+    assert not consumer.closed
+
+
+def test_install_uvloop__when_uvloop_is_not_installed(mocker, restore_policy):
+    # arrange
+    mocker.patch.dict(sys.modules, {'uvloop': None})
+    set_event_loop_policy = mocker.patch('asynqp_consumer.runner.asyncio.set_event_loop_policy')
+
+    # act
+    result = install_uvloop()
+
+    # assert
+    assert result is False
+    assert not set_event_loop_policy.called
+
+
+def test_install_uvloop__when_uvloop_is_installed(mocker, restore_policy):
+    # arrange
+    uvloop = mocker.Mock()
+    mocker.patch.dict(sys.modules, {'uvloop': uvloop})
+    set_event_loop_policy = mocker.patch('asynqp_consumer.runner.asyncio.set_event_loop_policy')
+
+    # act
+    result = install_uvloop()
+
+    # assert
+    assert result is True
+    set_event_loop_policy.assert_called_once_with(uvloop.EventLoopPolicy.return_value)
+
+
+def get_interrupted_consumer(mocker, interrupt_in):
+    consumer = Consumer(
+        queue=Queue(name='test_queue'),
+        callback=None,
+        connection_params=[ConnectionParams()],
+    )
+    connection = mocker.Mock(spec=asynqp.Connection)
+
+    async def connect():
+        connection.closed = asyncio.Future()
+        consumer._connection = connection
+        if interrupt_in == '_connect':
+            raise KeyboardInterrupt
+
+    async def process_queue():
+        raise KeyboardInterrupt
+
+    async def check_bulk():
+        try:
+            await asyncio.Future()
+        finally:
+            consumer.check_bulk_stopped = True
+
+    async def disconnect():
+        pass
+
+    mocker.patch.object(consumer, '_connect', side_effect=connect)
+    mocker.patch.object(consumer, '_process_queue', side_effect=process_queue)
+    mocker.patch.object(consumer, '_check_bulk', side_effect=check_bulk)
+    mocker.patch.object(consumer, '_disconnect', side_effect=disconnect)
+    return consumer
+
+
+@pytest.mark.parametrize('interrupt_in', ['_connect', '_process_queue'])
+def test_run__keyboard_interrupt_inside_consumer__disconnects(mocker, restore_policy, interrupt_in):
+    # arrange
+    consumer = get_interrupted_consumer(mocker, interrupt_in)
+
+    # act
+    run(consumer, use_uvloop=False)
+
+    # assert
+    consumer._disconnect.assert_called_once_with()
+    assert consumer._closed is None
+    assert consumer._check_bulk.called is (interrupt_in == '_process_queue')
+    assert getattr(consumer, 'check_bulk_stopped', False) is consumer._check_bulk.called
+
+
+def test_run__cancels_pending_tasks(mocker, restore_policy):
+    # arrange
+    consumer = FakeConsumer()
+    cancelled = []
+
+    async def background():
+        try:
+            await asyncio.Future()
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def start():
+        asyncio.ensure_future(background())
+        await asyncio.sleep(0)
+
+    consumer.start = start
+
+    # act
+    run(consumer, use_uvloop=False)
+
+    # assert
+    assert cancelled == [True]
+
+
+def test_run__restores_event_loop_policy(mocker, restore_policy):
+    # arrange
+    policy = asyncio.get_event_loop_policy()
+    uvloop = mocker.Mock()
+    uvloop.EventLoopPolicy.return_value = asyncio.DefaultEventLoopPolicy()
+    mocker.patch.dict(sys.modules, {'uvloop': uvloop})
+
+    # act
+    run(FakeConsumer())
+
+    # assert
+    uvloop.EventLoopPolicy.assert_called_once_with()
+    assert asyncio.get_event_loop_policy() is policy
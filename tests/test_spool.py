@@ -0,0 +1,197 @@
+import errno
+import os
+import threading
+
+import pytest
+
+from asynqp_consumer import Spool
+
+
+def test_append_and_read(tmp_path):
+    # arrange
+    spool = Spool(str(tmp_path))
+
+    # act
+    spool.append([(b'{"a": 1}', None), (b'gzipped', 'gzip')])
+    result = spool.read(10)
+
+    # assert
+    assert [(r.body, r.content_encoding) for r in result] == [(b'{"a": 1}', None), (b'gzipped', 'gzip')]
+    assert spool.read(10) == []
+
+
+def test_read__max_count(tmp_path):
+    # arrange
+    spool = Spool(str(tmp_path))
+    spool.append([(str(i).encode(), None) for i in range(5)])
+
+    # act
+    first = spool.read(3)
+    second = spool.read(3)
+
+    # assert
+    assert [r.body for r in first] == [b'0', b'1', b'2']
+    assert [r.body for r in second] == [b'3', b'4']
+
+
+def test_rewind__replays_from_checkpoint(tmp_path):
+    # arrange
+    spool = Spool(str(tmp_path))
+    spool.append([(str(i).encode(), None) for i in range(4)])
+    spool.commit(spool.read(2)[-1].position)
+    spool.read(2)
+
+    # act
+    spool.rewind()
+
+    # assert
+    assert [r.body for r in spool.read(10)] == [b'2', b'3']
+
+
+def test_recovery_after_restart(tmp_path):
+    # arrange
+    spool = Spool(str(tmp_path))
+    spool.append([(str(i).encode(), None) for i in range(4)])
+    spool.commit(spool.read(1)[-1].position)
+    spool.close()
+
+    # act
+    spool = Spool(str(tmp_path))
+    spool.append([(b'4', None)])
+
+    # assert
+    assert [r.body for r in spool.read(10)] == [b'1', b'2', b'3', b'4']
+
+
+def test_recovery__ignores_torn_record(tmp_path):
+    # arrange
+    spool = Spool(str(tmp_path))
+    spool.append([(b'first', None), (b'second', None)])
+    spool.close()
+
+    segment_path = os.path.join(str(tmp_path), '{:020d}.log'.format(0))
+    with open(segment_path, 'r+b') as f:
+        f.seek(Spool._HEADER.size + len(b'first') + Spool._HEADER.size)
+        f.write(b'XXXXXX')
+
+    # act
+    spool = Spool(str(tmp_path))
+    spool.append([(b'third', None)])
+
+    # assert
+    assert [r.body for r in spool.read(10)] == [b'first', b'third']
+
+
+def test_segments_roll_over_and_are_deleted_after_commit(tmp_path):
+    # arrange
+    spool = Spool(str(tmp_path), segment_size=64)
+    spool.append([(b'x' * 40, None) for _ in range(3)])
+    spool.append([(b'y' * 100, None)])
+
+    # act
+    records = spool.read(10)
+    spool.commit(records[-1].position)
+
+    # assert
+    assert [r.body for r in records] == [b'x' * 40] * 3 + [b'y' * 100]
+    assert sorted(name for name in os.listdir(str(tmp_path)) if name.endswith('.log')) == [
+        '{:020d}.log'.format(3),
+    ]
+
+
+def test_segments_are_preallocated(tmp_path):
+    # act
+    Spool(str(tmp_path), segment_size=1024 * 1024)
+
+    # assert
+    stat = os.stat(os.path.join(str(tmp_path), '{:020d}.log'.format(0)))
+    assert stat.st_size == 1024 * 1024
+    assert stat.st_blocks * 512 >= 1024 * 1024
+
+
+def test_segments_are_written_when_fallocate_is_not_supported(tmp_path, mocker):
+    # arrange
+    mocker.patch('asynqp_consumer.spool.os.posix_fallocate', side_effect=OSError(errno.EOPNOTSUPP, 'Not supported'))
+
+    # act
+    spool = Spool(str(tmp_path), segment_size=3 * 1024 * 1024 + 1)
+    spool.append([(b'{"a": 1}', None)])
+
+    # assert
+    stat = os.stat(os.path.join(str(tmp_path), '{:020d}.log'.format(0)))
+    assert stat.st_size == 3 * 1024 * 1024 + 1
+    assert stat.st_blocks * 512 >= stat.st_size
+    assert [r.body for r in spool.read(10)] == [b'{"a": 1}']
+
+
+def test_append__when_disk_is_full(tmp_path, mocker):
+    # arrange
+    spool = Spool(str(tmp_path), segment_size=64)
+    spool.append([(b'x' * 40, None)])
+    allocate = os.posix_fallocate
+    posix_fallocate = mocker.patch(
+        'asynqp_consumer.spool.os.posix_fallocate',
+        side_effect=OSError(errno.ENOSPC, 'No space left on device'),
+    )
+
+    # act
+    with pytest.raises(OSError):
+        spool.append([(b'y' * 40, None)])
+    posix_fallocate.side_effect = allocate
+    spool.append([(b'z' * 40, None)])
+
+    # assert
+    assert [r.body for r in spool.read(10)] == [b'x' * 40, b'z' * 40]
+    assert sorted(name for name in os.listdir(str(tmp_path)) if name.endswith('.log')) == [
+        '{:020d}.log'.format(0),
+        '{:020d}.log'.format(1),
+    ]
+
+
+@pytest.mark.parametrize('size', [0, 5])
+def test_recovery__reallocates_short_trailing_segment(tmp_path, size):
+    # arrange
+    spool = Spool(str(tmp_path), segment_size=64)
+    spool.append([(b'x' * 40, None)])
+    spool.close()
+    with open(os.path.join(str(tmp_path), '{:020d}.log'.format(1)), 'wb') as f:
+        f.write(bytes(size))
+
+    # act
+    spool = Spool(str(tmp_path), segment_size=64)
+    spool.append([(b'y' * 40, None)])
+
+    # assert
+    assert [r.body for r in spool.read(10)] == [b'x' * 40, b'y' * 40]
+    assert os.path.getsize(os.path.join(str(tmp_path), '{:020d}.log'.format(1))) == 64
+
+
+def test_recovery__removes_partially_allocated_segment(tmp_path):
+    # arrange
+    Spool(str(tmp_path)).close()
+    temp_path = os.path.join(str(tmp_path), '{:020d}.log.tmp'.format(1))
+    with open(temp_path, 'wb') as f:
+        f.write(bytes(10))
+
+    # act
+    Spool(str(tmp_path))
+
+    # assert
+    assert not os.path.exists(temp_path)
+
+
+def test_append_and_read_from_different_threads(tmp_path):
+    # arrange
+    spool = Spool(str(tmp_path), segment_size=256)
+    writer = threading.Thread(target=lambda: [spool.append([(str(i).encode(), None)]) for i in range(500)])
+
+    # act
+    writer.start()
+    result = []
+    while writer.is_alive():
+        result.extend(record.body for record in spool.read(10))
+    writer.join()
+    result.extend(record.body for record in spool.read(500))
+
+    # assert
+    assert result == [str(i).encode() for i in range(500)]